@@ -1,216 +1,231 @@
 import streamlit as st
 import pandas as pd
-import requests
-import numpy as np
+import pydeck as pdk
 from datetime import datetime
 import itertools
 import os
+import hashlib
+from collections import OrderedDict
+
+from engine import (EngineError, RouteEngine, day_addresses, day_fingerprint, failed_leg_count, format_day,
+                    is_complete, split_days, summary_row)
+from geometry import simplify_for_zoom, zoom_for_bounds
+from ingest import build_day_index, read_table
+from jobs import CANCELLED, COMPLETED, RUNNING, CheckpointStore, get_job, start_job
+from metrics import Metrics, collect, enable_stream_logging, log_metrics, stage
 
 st.set_page_config(page_title="Calcolatore Tragitto Multi-Tappa", layout="wide")
 
 st.title("Calcolatore del Tragitto Minimo tra Casa e Lavori")
 
-# Funzione per caricare il file CSV
+# Funzione per caricare il file (CSV, Parquet o Excel) in una sola passata
 def load_csv(uploaded_file):
     if uploaded_file is not None:
         try:
-            # Prova prima con punto e virgola come separatore (formato italiano comune)
-            df = pd.read_csv(uploaded_file, sep=";")
-            # Controlla se abbiamo le colonne attese
-            if not all(col in df.columns for col in ["CASA", "LAVORO", "GIORNO"]):
-                # Prova con virgola come separatore
-                df = pd.read_csv(uploaded_file, sep=",")
-            
-            # Pulisci gli spazi bianchi nelle intestazioni
-            df.columns = df.columns.str.strip()
-            return df
+            uploaded_file.seek(0)
+            return read_table(uploaded_file, uploaded_file.name)
         except Exception as e:
             st.error(f"Errore nel caricamento del file: {e}")
             return None
     return None
 
-# Funzione per geocodificare un indirizzo usando OpenStreetMap Nominatim API
-def geocode_address(address):
-    try:
-        base_url = "https://nominatim.openstreetmap.org/search"
-        params = {
-            "q": address,
-            "format": "json",
-            "limit": 1
-        }
-        headers = {
-            "User-Agent": "TragittoCalculator/1.0"  # Necessario per le regole di Nominatim
-        }
-        
-        response = requests.get(base_url, params=params, headers=headers)
-        data = response.json()
-        
-        if data and len(data) > 0:
-            lat = float(data[0]["lat"])
-            lon = float(data[0]["lon"])
-            return lat, lon
-        else:
-            return None
-    except Exception as e:
-        st.error(f"Errore durante la geocodifica: {e}")
-        return None
+# Funzione per caricare il file una sola volta per sessione, insieme all'indice dei giorni
+def load_table_cached(uploaded_file):
+    cached = st.session_state.get("tabella")
+    if cached is None or cached[0] != uploaded_file.file_id:
+        df = load_csv(uploaded_file)
+        cached = (uploaded_file.file_id, df, build_day_index(df) if df is not None else {})
+        if df is not None:
+            st.session_state["tabella"] = cached
+    return cached[1], cached[2]
 
-# Funzione per calcolare il percorso tra due punti usando OSRM
-def get_route(start_coords, end_coords):
-    try:
-        base_url = "http://router.project-osrm.org/route/v1/driving/"
-        url = f"{base_url}{start_coords[1]},{start_coords[0]};{end_coords[1]},{end_coords[0]}"
-        params = {
-            "overview": "full",
-            "geometries": "geojson"
-        }
+# Motore di calcolo (con le sue cache persistenti e in memoria), condiviso da tutte le sessioni
+# del server: le richieste identiche di sessioni diverse partono una volta sola (vedi shared)
+@st.cache_resource
+def get_engine():
+    return RouteEngine()
+
+# Giorni calcolati tenuti nella memoria di ogni sessione: oltre questo numero vengono
+# scartati i meno usati di recente (restano comunque nelle cache e tra i salvataggi)
+MAX_SESSION_DAY_RESULTS = 366
+
+# Funzione per ottenere la memoria dei giorni calcolati della sessione
+def session_results():
+    return st.session_state.setdefault("day_results", OrderedDict())
+
+# Funzione per conservare i risultati {chiave: risultato} nella memoria della sessione
+def remember_results(results):
+    memo = session_results()
+    for key, result in results.items():
+        memo[key] = result
+        memo.move_to_end(key)
+    while len(memo) > MAX_SESSION_DAY_RESULTS:
+        memo.popitem(last=False)
+
+# Funzione per calcolare il percorso di un giorno, riusando i risultati dei rerun precedenti.
+# I risultati sono indicizzati sul contenuto del giorno (casa e lavori), quindi caricando
+# un CSV modificato vengono ricalcolati solo i giorni le cui righe sono cambiate.
+# I risultati con tratte stimate per un errore del router non vengono conservati: al
+# calcolo successivo vengono richieste di nuovo solo quelle tratte.
+def plan_day_cached(giorno, casa_address, lavoro_addresses, objective="distance", mode="exact"):
+    key = day_fingerprint(casa_address, lavoro_addresses, objective, mode)
+    result = session_results().get(key)
+    if result is None:
+        result = get_engine().plan_day(giorno, casa_address, lavoro_addresses, objective, mode)
+    if is_complete(result):
+        remember_results({key: result})
+    return {**result, "giorno": giorno}
+
+# Archivio dei risultati dei singoli giorni, per riprendere i calcoli interrotti
+@st.cache_resource
+def get_checkpoint_store():
+    return CheckpointStore()
+
+# Le misure in JSON vanno sul log del server (una sola volta per processo)
+@st.cache_resource
+def setup_metrics_logging():
+    enable_stream_logging()
+    return True
+
+setup_metrics_logging()
+
+# Funzione per elencare i giorni del file con l'impronta del loro contenuto
+def summary_days(df, objective="distance", mode="exact"):
+    return [
+        (giorno, filtered_df, day_fingerprint(*day_addresses(filtered_df), objective, mode))
+        for giorno, filtered_df in split_days(df)
+    ]
+
+# Funzione per avviare in background il calcolo dei giorni mancanti (o ritrovare quello in corso).
+# I giorni già calcolati in questa sessione o salvati da un calcolo precedente non vengono ricalcolati.
+def start_summary_job(job_key, days, objective="distance", mode="exact"):
+    return start_job(job_key, get_engine(), days, objective, mode, store=get_checkpoint_store(),
+                     known=dict(session_results()))
+
+# Funzione per calcolare la sommatoria dei km dei giorni con un risultato disponibile
+def calculate_total_km_for_all_days(days, results):
+    risultati_totali = []
+    distanza_totale_complessiva = 0
+    durata_totale_complessiva = 0
+
+    for giorno, filtered_df, key in days:
+        if key not in results:
+            continue
+        result = {**results[key], "giorno": giorno}
         
-        response = requests.get(url, params=params)
-        data = response.json()
+        # Aggiungi ai totali complessivi
+        distanza_totale_complessiva += result["total_distance"]
+        durata_totale_complessiva += result["total_duration"]
         
-        if data["code"] == "Ok":
-            route = data["routes"][0]
-            distance = route["distance"] / 1000  # Converti in km
-            duration = route["duration"] / 60  # Converti in minuti
-            return distance, duration
-        else:
-            st.warning("Non è stato possibile calcolare il percorso")
-            return None, None
-    except Exception as e:
-        st.error(f"Errore durante il calcolo del percorso: {e}")
-        return None, None
+        # Salva risultati per questo giorno
+        risultati_totali.append(summary_row(result))
+    
+    return risultati_totali, round(distanza_totale_complessiva, 2), round(durata_totale_complessiva, 0)
 
-# Funzione per calcolare la matrice delle distanze tra tutti i punti
-def calculate_distance_matrix(coords_list):
-    n = len(coords_list)
-    distances = np.zeros((n, n))
-    durations = np.zeros((n, n))
+# Funzione per visualizzare tabella, totali e grafico del riepilogo
+def show_summary(risultati_totali, distanza_totale_complessiva, durata_totale_complessiva):
+    # Visualizza tabella con i risultati per ogni giorno
+    st.subheader("Dettaglio per Giorno")
+    risultati_df = pd.DataFrame(risultati_totali)
+    st.table(risultati_df)
     
-    for i in range(n):
-        for j in range(n):
-            if i != j:
-                dist, dur = get_route(coords_list[i], coords_list[j])
-                if dist is not None and dur is not None:
-                    distances[i, j] = dist
-                    durations[i, j] = dur
-                else:
-                    st.error(f"Impossibile calcolare la distanza tra i punti {i} e {j}")
-                    return None, None
+    # Visualizza i totali complessivi
+    st.subheader("Riepilogo Complessivo")
+    st.write(f"**Numero totale di giorni:** {len(risultati_totali)}")
+    st.write(f"**Distanza totale complessiva:** {distanza_totale_complessiva} km")
+    st.write(f"**Tempo totale stimato complessivo:** {durata_totale_complessiva} minuti")
+    tratte_stimate = sum(r["Tratte Stimate"] for r in risultati_totali)
+    if tratte_stimate:
+        st.warning(
+            f"{tratte_stimate} tratte sono stimate in linea d'aria perché il router non ha risposto: "
+            "verranno richieste di nuovo al prossimo calcolo."
+        )
     
-    return distances, durations
+    # Visualizza un grafico delle distanze per giorno
+    st.subheader("Grafico delle Distanze per Giorno")
+    chart_data = pd.DataFrame({
+        'Giorno': [r['Giorno'] for r in risultati_totali],
+        'Distanza (km)': [r['Distanza Totale (km)'] for r in risultati_totali]
+    })
+    st.bar_chart(chart_data.set_index('Giorno'))
 
-# Funzione per trovare il percorso ottimale (algoritmo greedy)
-def find_optimal_route(distances, start_index):
-    n = distances.shape[0]
-    current = start_index
-    path = [current]
-    remaining = set(range(n))
-    remaining.remove(current)
+# Avanzamento del calcolo in background, aggiornato ogni secondo: i giorni compaiono man mano
+# che vengono calcolati; alla fine l'intera pagina viene ricaricata con il riepilogo completo
+@st.fragment(run_every=1)
+def show_job_progress(job, days):
+    progress = job.progress()
+    if progress["status"] != RUNNING:
+        st.rerun()
     
-    # Se abbiamo solo casa e un lavoro
-    if n <= 2:
-        return list(range(n))
+    st.progress(
+        progress["done"] / max(progress["total"], 1),
+        text=f"Calcolo dei percorsi in corso: {progress['done']} giorni su {progress['total']}",
+    )
+    if st.button("Interrompi calcolo"):
+        job.cancel()
+        st.info("Il calcolo verrà interrotto al termine del giorno in corso.")
     
-    # Percorso con casa -> lavori -> casa
-    while remaining:
-        if len(remaining) == 1 and 0 in remaining:
-            # Se è rimasto solo casa (0), aggiungiamolo
-            next_stop = 0
-        else:
-            # Trova il prossimo posto più vicino (non casa se ci sono ancora altri posti)
-            next_stop = min(
-                [i for i in remaining if (i != 0 or len(remaining) == 1)],
-                key=lambda x: distances[current, x]
-            )
-        
-        path.append(next_stop)
-        remaining.remove(next_stop)
-        current = next_stop
+    risultati_totali, distanza, durata = calculate_total_km_for_all_days(days, progress["results"])
+    if risultati_totali:
+        show_summary(risultati_totali, distanza, durata)
+
+# Funzione per disegnare il percorso su una mappa, con la geometria semplificata per lo zoom della mappa
+def show_route_map(all_coords, all_addresses, optimal_route, geometry):
+    points = [point for leg in geometry for point in leg]
+    zoom = zoom_for_bounds(points)
     
-    # Se non torniamo a casa alla fine, aggiungiamo casa
-    if path[-1] != 0:
-        path.append(0)
+    paths = [
+        {
+            "path": [[lon, lat] for lat, lon in simplify_for_zoom(leg, zoom)],
+            "tratta": f"{all_addresses[from_idx]} → {all_addresses[to_idx]}",
+        }
+        for leg, from_idx, to_idx in zip(geometry, optimal_route[:-1], optimal_route[1:])
+    ]
+    stops = [
+        {
+            "position": [all_coords[idx][1], all_coords[idx][0]],
+            "tratta": f"{i}. {all_addresses[idx]}",
+            "color": [200, 30, 30] if idx == 0 else [30, 90, 200],
+        }
+        for i, idx in enumerate(optimal_route[:-1], 1)
+    ]
     
-    return path
+    st.pydeck_chart(pdk.Deck(
+        layers=[
+            pdk.Layer("PathLayer", paths, get_path="path", get_color=[30, 90, 200], get_width=4,
+                      width_units="pixels", pickable=True),
+            pdk.Layer("ScatterplotLayer", stops, get_position="position", get_fill_color="color",
+                      get_radius=7, radius_units="pixels", pickable=True),
+        ],
+        initial_view_state=pdk.ViewState(
+            latitude=sum(p[0] for p in points) / len(points),
+            longitude=sum(p[1] for p in points) / len(points),
+            zoom=zoom,
+        ),
+        tooltip={"text": "{tratta}"},
+    ))
+    st.caption(f"Punti disegnati: {sum(len(p['path']) for p in paths)} (geometria completa: {len(points)})")
 
-# Funzione per calcolare e visualizzare la sommatoria dei km per tutti i giorni
-def calculate_total_km_for_all_days(df):
-    giorni_disponibili = df["GIORNO"].unique().tolist()
-    risultati_totali = []
-    distanza_totale_complessiva = 0
-    durata_totale_complessiva = 0
+# Funzione per calcolare un'impronta dell'intero file (giorni e relativi indirizzi)
+def dataset_fingerprint(df, objective="distance", mode="exact"):
+    digest = hashlib.sha256()
+    for giorno, filtered_df in split_days(df):
+        digest.update(f"{giorno}|{day_fingerprint(*day_addresses(filtered_df), objective, mode)}\n".encode("utf-8"))
+    return digest.hexdigest()
 
-    with st.spinner("Calcolo dei percorsi per tutti i giorni..."):
-        for giorno in giorni_disponibili:
-            # Filtra per il giorno corrente
-            filtered_df = df[df["GIORNO"] == giorno]
-            
-            if not filtered_df.empty:
-                # Ottieni tutti gli indirizzi unici per quel giorno
-                casa_address = filtered_df["CASA"].iloc[0]
-                lavoro_addresses = filtered_df["LAVORO"].unique().tolist()
-                
-                # Geocodifica tutti gli indirizzi
-                coords_casa = geocode_address(casa_address)
-                if coords_casa is None:
-                    st.error(f"Impossibile geocodificare l'indirizzo di casa per il giorno {giorno}: {casa_address}")
-                    continue
-                
-                coords_lavoro_list = []
-                geocode_failed = False
-                for addr in lavoro_addresses:
-                    coords = geocode_address(addr)
-                    if coords is None:
-                        st.error(f"Impossibile geocodificare l'indirizzo di lavoro per il giorno {giorno}: {addr}")
-                        geocode_failed = True
-                        break
-                    coords_lavoro_list.append(coords)
-                
-                if geocode_failed:
-                    continue
-                
-                # Crea lista completa di coordinate con casa come prima posizione
-                all_coords = [coords_casa] + coords_lavoro_list
-                
-                # Calcola la matrice delle distanze
-                distances, durations = calculate_distance_matrix(all_coords)
-                
-                if distances is None or durations is None:
-                    st.error(f"Impossibile calcolare la matrice delle distanze per il giorno {giorno}.")
-                    continue
-                
-                # Trova il percorso ottimale
-                optimal_route = find_optimal_route(distances, 0)
-                
-                # Calcola la distanza totale e la durata
-                total_distance = 0
-                total_duration = 0
-                
-                for i in range(len(optimal_route) - 1):
-                    from_idx = optimal_route[i]
-                    to_idx = optimal_route[i + 1]
-                    total_distance += distances[from_idx, to_idx]
-                    total_duration += durations[from_idx, to_idx]
-                
-                # Aggiungi ai totali complessivi
-                distanza_totale_complessiva += total_distance
-                durata_totale_complessiva += total_duration
-                
-                # Salva risultati per questo giorno
-                risultati_totali.append({
-                    "Giorno": giorno,
-                    "Numero Lavori": len(lavoro_addresses),
-                    "Distanza Totale (km)": round(total_distance, 2),
-                    "Tempo Stimato (min)": round(total_duration, 0)
-                })
-    
-    return risultati_totali, round(distanza_totale_complessiva, 2), round(durata_totale_complessiva, 0)
+# Funzione per registrare le misure di un calcolo (pannello "Prestazioni" e log JSON)
+def record_performance(event, metrics, **fields):
+    st.session_state["prestazioni"] = log_metrics(event, metrics, **fields)
+
+# Misure di prestazione di questa esecuzione dello script
+run_metrics = Metrics()
 
 # Sezione per il caricamento del file
-uploaded_file = st.file_uploader("Carica il tuo file CSV", type=["csv"])
+uploaded_file = st.file_uploader("Carica il tuo file CSV", type=["csv", "parquet", "xlsx"])
 
 if uploaded_file:
-    df = load_csv(uploaded_file)
+    with collect(run_metrics), stage("csv_load"):
+        df, day_index = load_table_cached(uploaded_file)
     
     if df is not None:
         st.success("File caricato con successo!")
@@ -219,6 +234,18 @@ if uploaded_file:
         st.subheader("Anteprima dei dati")
         st.dataframe(df.head())
         
+        # Criterio di ottimizzazione del percorso
+        objective_label = st.radio("Ottimizza il percorso per", ["Distanza", "Tempo"], horizontal=True)
+        objective = "duration" if objective_label == "Tempo" else "distance"
+        
+        # Modalità di calcolo delle distanze
+        modes = {
+            "Esatta": "exact",
+            "Ibrida (router solo per le tratte plausibili)": "hybrid",
+            "Solo stima (istantanea, senza router)": "estimate",
+        }
+        mode = modes[st.radio("Modalità di calcolo", list(modes), horizontal=True)]
+        
         # Aggiungi tab per separare le funzionalità
         tab1, tab2 = st.tabs(["Calcolo Giornaliero", "Riepilogo Totale"])
         
@@ -235,75 +262,65 @@ if uploaded_file:
                     submit = st.form_submit_button("Aggiungi")
                     
                     if submit and casa and lavoro:
-                        new_row = pd.DataFrame({"CASA": [casa], "LAVORO": [lavoro], "GIORNO": [giorno.strftime("%d/%m/%Y")]})
+                        new_row = pd.DataFrame({"CASA": [casa], "LAVORO": [lavoro], "GIORNO": [pd.Timestamp(giorno)]})
                         df = pd.concat([df, new_row], ignore_index=True)
+                        day_index = build_day_index(df)
                         st.success("Indirizzo aggiunto!")
                         st.dataframe(df)
             
             # Sezione per selezionare un giorno dal CSV
             if not df.empty:
-                giorni_disponibili = df["GIORNO"].unique().tolist()
+                giorni_disponibili = list(day_index)
                 
                 if giorni_disponibili:
-                    giorno_selezionato = st.selectbox("Seleziona un giorno", giorni_disponibili)
+                    giorno_selezionato = st.selectbox("Seleziona un giorno", giorni_disponibili, format_func=format_day)
                     
                     if st.button("Calcola Tragitto Ottimale"):
-                        # Filtra per il giorno selezionato
-                        filtered_df = df[df["GIORNO"] == giorno_selezionato]
+                        # Righe del giorno selezionato, dall'indice dei giorni
+                        filtered_df = df.iloc[day_index[giorno_selezionato]]
                         
                         if not filtered_df.empty:
                             # Ottieni tutti gli indirizzi unici per quel giorno
-                            casa_address = filtered_df["CASA"].iloc[0]  # Prendiamo il primo indirizzo casa come punto di partenza
-                            lavoro_addresses = filtered_df["LAVORO"].unique().tolist()
+                            casa_address, lavoro_addresses = day_addresses(filtered_df)
                             
-                            st.write(f"**Giorno selezionato:** {giorno_selezionato}")
+                            st.write(f"**Giorno selezionato:** {format_day(giorno_selezionato)}")
                             st.write(f"**Indirizzo casa:** {casa_address}")
                             st.write(f"**Indirizzi lavoro ({len(lavoro_addresses)}):**")
                             for i, addr in enumerate(lavoro_addresses, 1):
                                 st.write(f"{i}. {addr}")
                             
-                            # Geocodifica tutti gli indirizzi
-                            with st.spinner("Geocodifica degli indirizzi in corso..."):
-                                coords_casa = geocode_address(casa_address)
-                                
-                                if coords_casa is None:
-                                    st.error(f"Impossibile geocodificare l'indirizzo di casa: {casa_address}")
-                                    st.stop()
-                                
-                                coords_lavoro_list = []
-                                for addr in lavoro_addresses:
-                                    coords = geocode_address(addr)
-                                    if coords is None:
-                                        st.error(f"Impossibile geocodificare l'indirizzo di lavoro: {addr}")
-                                        st.stop()
-                                    coords_lavoro_list.append(coords)
-                            
-                            # Crea lista completa di coordinate con casa come prima posizione
-                            all_coords = [coords_casa] + coords_lavoro_list
-                            all_addresses = [casa_address] + lavoro_addresses
+                            # Stima istantanea in linea d'aria mentre si attendono le distanze reali
+                            estimate_placeholder = st.empty()
+                            if mode != "estimate":
+                                try:
+                                    with collect(run_metrics):
+                                        estimate = plan_day_cached(giorno_selezionato, casa_address, lavoro_addresses, objective, "estimate")
+                                    estimate_placeholder.info(
+                                        f"Stima immediata: {estimate['total_distance']:.2f} km, "
+                                        f"{estimate['total_duration']:.0f} minuti. Calcolo delle distanze reali in corso..."
+                                    )
+                                except EngineError:
+                                    pass
                             
-                            # Calcola la matrice delle distanze
-                            with st.spinner("Calcolo delle distanze tra tutti i punti..."):
-                                distances, durations = calculate_distance_matrix(all_coords)
-                                
-                                if distances is None or durations is None:
-                                    st.error("Impossibile calcolare la matrice delle distanze.")
+                            # Geocodifica, matrice delle distanze e percorso ottimale
+                            with st.spinner("Calcolo del percorso ottimale..."):
+                                try:
+                                    with collect(run_metrics):
+                                        result = plan_day_cached(giorno_selezionato, casa_address, lavoro_addresses, objective, mode)
+                                except EngineError as e:
+                                    record_performance("calcolo_giornaliero", run_metrics, giorno=format_day(giorno_selezionato), mode=mode, errore=str(e))
+                                    estimate_placeholder.empty()
+                                    st.error(str(e))
                                     st.stop()
+                            estimate_placeholder.empty()
                             
-                            # Trova il percorso ottimale
-                            with st.spinner("Calcolo del percorso ottimale..."):
-                                # Casa è sempre indice 0
-                                optimal_route = find_optimal_route(distances, 0)
-                                
-                                # Calcola la distanza totale e la durata
-                                total_distance = 0
-                                total_duration = 0
-                                
-                                for i in range(len(optimal_route) - 1):
-                                    from_idx = optimal_route[i]
-                                    to_idx = optimal_route[i + 1]
-                                    total_distance += distances[from_idx, to_idx]
-                                    total_duration += durations[from_idx, to_idx]
+                            # Casa è sempre indice 0
+                            all_coords = result["coords"]
+                            all_addresses = result["addresses"]
+                            distances = result["distances"]
+                            optimal_route = result["route"]
+                            total_distance = result["total_distance"]
+                            total_duration = result["total_duration"]
                             
                             # Mostra i risultati
                             st.subheader("Percorso Ottimale")
@@ -335,6 +352,24 @@ if uploaded_file:
                             st.subheader("Riepilogo")
                             st.write(f"**Distanza totale:** {total_distance:.2f} km")
                             st.write(f"**Tempo totale stimato:** {total_duration:.0f} minuti")
+                            if mode == "estimate":
+                                st.caption("Valori stimati dalla distanza in linea d'aria, senza interrogare il router.")
+                            tratte_stimate = failed_leg_count(result)
+                            if tratte_stimate:
+                                st.warning(
+                                    f"{tratte_stimate} tratte del percorso sono stimate in linea d'aria perché il router "
+                                    "non ha risposto: verranno richieste di nuovo al prossimo calcolo."
+                                )
+                            
+                            # Mappa del percorso: la geometria viene richiesta solo per le tratte del percorso scelto
+                            st.subheader("Mappa del Percorso")
+                            try:
+                                with collect(run_metrics):
+                                    geometry = get_engine().route_geometry(all_coords, optimal_route)
+                                show_route_map(all_coords, all_addresses, optimal_route, geometry)
+                            except Exception as e:
+                                st.warning(f"Impossibile disegnare la mappa del percorso: {e}")
+                            record_performance("calcolo_giornaliero", run_metrics, giorno=format_day(giorno_selezionato), mode=mode)
                             
                             # Creazione di link per visualizzare l'intero percorso su Google Maps
                             st.subheader("Visualizza su Google Maps")
@@ -391,7 +426,7 @@ if uploaded_file:
                                     
                                     st.markdown(f"[{from_address} → {to_address}]({segment_url})")
                         else:
-                            st.warning(f"Nessun dato trovato per il giorno {giorno_selezionato}.")
+                            st.warning(f"Nessun dato trovato per il giorno {format_day(giorno_selezionato)}.")
                 else:
                     st.warning("Nessun giorno trovato nel file CSV.")
         
@@ -399,30 +434,46 @@ if uploaded_file:
             st.subheader("Calcolo Sommatoria Chilometri per Tutti i Giorni")
             
             if not df.empty:
+                # Il calcolo gira in background ed è associato al file e al criterio: sopravvive ai
+                # rerun e al refresh del browser, e il riepilogo resta visibile finché non cambiano
+                riepilogo_key = dataset_fingerprint(df, objective, mode)
+                days = summary_days(df, objective, mode)
+                
                 if st.button("Calcola Totale per Tutti i Giorni"):
-                    risultati_totali, distanza_totale_complessiva, durata_totale_complessiva = calculate_total_km_for_all_days(df)
+                    start_summary_job(riepilogo_key, days, objective, mode)
+                
+                job = get_job(riepilogo_key)
+                if job is not None and job.progress()["status"] == RUNNING:
+                    show_job_progress(job, days)
+                else:
+                    if job is not None and st.session_state.get("riepilogo_job") is not job:
+                        # Calcolo appena terminato: i risultati passano nella memoria della sessione
+                        progress = job.progress()
+                        remember_results({key: result for key, result in progress["results"].items() if is_complete(result)})
+                        st.session_state["riepilogo"] = (
+                            riepilogo_key,
+                            calculate_total_km_for_all_days(days, progress["results"]),
+                            list(dict.fromkeys(progress["errors"].values())),
+                            progress["status"],
+                        )
+                        st.session_state["riepilogo_job"] = job
+                        if job.performance is not None:
+                            st.session_state["prestazioni"] = job.performance
                     
-                    if risultati_totali:
-                        # Visualizza tabella con i risultati per ogni giorno
-                        st.subheader("Dettaglio per Giorno")
-                        risultati_df = pd.DataFrame(risultati_totali)
-                        st.table(risultati_df)
-                        
-                        # Visualizza i totali complessivi
-                        st.subheader("Riepilogo Complessivo")
-                        st.write(f"**Numero totale di giorni:** {len(risultati_totali)}")
-                        st.write(f"**Distanza totale complessiva:** {distanza_totale_complessiva} km")
-                        st.write(f"**Tempo totale stimato complessivo:** {durata_totale_complessiva} minuti")
+                    riepilogo = st.session_state.get("riepilogo")
+                    if riepilogo is not None and riepilogo[0] == riepilogo_key:
+                        risultati_totali, distanza_totale_complessiva, durata_totale_complessiva = riepilogo[1]
+                        for error in riepilogo[2]:
+                            st.error(error)
+                        if riepilogo[3] == CANCELLED:
+                            st.warning("Calcolo interrotto: premi 'Calcola Totale per Tutti i Giorni' per riprendere dai giorni mancanti.")
+                        elif riepilogo[3] != COMPLETED:
+                            st.error("Il calcolo si è interrotto per un errore: premi 'Calcola Totale per Tutti i Giorni' per riprendere dai giorni mancanti.")
                         
-                        # Visualizza un grafico delle distanze per giorno
-                        st.subheader("Grafico delle Distanze per Giorno")
-                        chart_data = pd.DataFrame({
-                            'Giorno': [r['Giorno'] for r in risultati_totali],
-                            'Distanza (km)': [r['Distanza Totale (km)'] for r in risultati_totali]
-                        })
-                        st.bar_chart(chart_data.set_index('Giorno'))
-                    else:
-                        st.warning("Non è stato possibile calcolare i percorsi per nessun giorno.")
+                        if risultati_totali:
+                            show_summary(risultati_totali, distanza_totale_complessiva, durata_totale_complessiva)
+                        else:
+                            st.warning("Non è stato possibile calcolare i percorsi per nessun giorno.")
             else:
                 st.info("Carica un file CSV con dati validi per calcolare la sommatoria dei chilometri.")
 else:
@@ -461,12 +512,40 @@ else:
                 st.success("File creato con successo!")
                 st.dataframe(df)
 
+# Pannello con tempi e contatori dell'ultimo calcolo, per capire dove si perde tempo
+with st.expander("Prestazioni"):
+    prestazioni = st.session_state.get("prestazioni")
+    if prestazioni is None:
+        st.write("Nessun calcolo eseguito in questa sessione.")
+    else:
+        st.write(f"**Ultimo calcolo:** {prestazioni['event']} ({prestazioni['time']})")
+        if prestazioni["stages"]:
+            st.table(pd.DataFrame([
+                {
+                    "Fase": name,
+                    "Tempo totale (s)": f"{entry['seconds']:.3f}",
+                    "Chiamate": entry["calls"],
+                    "Chiamata più lenta (s)": f"{entry['max_seconds']:.3f}",
+                }
+                for name, entry in sorted(prestazioni["stages"].items(), key=lambda item: -item[1]["seconds"])
+            ]))
+        if prestazioni["counters"]:
+            st.table(pd.DataFrame(
+                [{"Contatore": name, "Valore": value} for name, value in sorted(prestazioni["counters"].items())]
+            ))
+        st.caption(
+            "csv_load: lettura del file; geocode: geocodifica; matrix: distanze tra i punti; "
+            "solve: calcolo del percorso; totals: totali. http.nominatim e http.osrm sono il tempo "
+            "delle richieste ai servizi esterni (eseguite in parallelo, quindi possono superare la "
+            "durata della fase), http.*.throttle l'attesa imposta dal limite di frequenza."
+        )
+
 # Aggiungi istruzioni d'uso
 with st.expander("Come usare questa applicazione"):
     st.markdown("""
     ### Istruzioni per l'uso
     
-    1. **Carica il tuo file CSV** con le colonne CASA, LAVORO e GIORNO.
+    1. **Carica il tuo file CSV** (oppure Parquet o Excel) con le colonne CASA, LAVORO e GIORNO.
     2. **Seleziona un giorno** dalla lista dei giorni disponibili oppure usa la tab "Riepilogo Totale" per calcolare i km totali per tutti i giorni.
     3. **Premi 'Calcola Tragitto Ottimale'** per vedere il percorso ottimale che inizia da casa, passa per tutti i luoghi di lavoro e torna a casa.
     4. **Premi 'Calcola Totale per Tutti i Giorni'** nella tab "Riepilogo Totale" per vedere la sommatoria dei chilometri per tutti i giorni.
@@ -488,9 +567,10 @@ with st.expander("Come usare questa applicazione"):
     
     ### Note
     - L'applicazione calcola il percorso ottimale partendo da casa, passando per tutti i luoghi di lavoro e tornando a casa.
+    - Fino a 15 luoghi di lavoro il percorso è quello ottimo esatto; oltre viene migliorato con una ricerca locale. Puoi ottimizzare per distanza o per tempo.
     - Per ogni giorno, puoi avere più luoghi di lavoro da visitare.
     - L'applicazione utilizza API gratuite (OpenStreetMap e OSRM) per la geocodifica e il calcolo del percorso.
-    - Il calcolo della sommatoria totale può richiedere tempo se ci sono molti giorni/indirizzi.
+    - Il calcolo della sommatoria totale può richiedere tempo se ci sono molti giorni/indirizzi: viene eseguito in background, i giorni compaiono man mano che vengono calcolati e, se interrotto, riprende dai giorni mancanti.
     """)
 
 # Footer con informazioni
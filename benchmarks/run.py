@@ -0,0 +1,220 @@
+"""
+Benchmark della pipeline geocodifica → matrice → percorso → totali contro
+server Nominatim/OSRM finti locali (vedi stub_servers).
+
+Per ogni scenario genera un CSV sintetico riproducibile, lo elabora con
+RouteEngine partendo da cache vuote e misura tempo totale, tempo per fase
+(vedi metrics) e richieste HTTP ricevute dai server finti. I risultati possono essere salvati in JSON e confrontati con
+un'esecuzione precedente per individuare regressioni.
+
+Esempi (dalla cartella principale del progetto):
+    python -m benchmarks.run
+    python -m benchmarks.run --scenario month --latency 0.05 --jitter 0.02 -o risultati.json
+    python -m benchmarks.run --baseline risultati.json
+    python -m benchmarks.run --error-rate 0.2 --error-status 429 --transient-errors
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.stub_servers import StubServer
+from engine import RouteEngine, is_complete, split_days
+from geocache import GeocodeCache
+from geometry import GeometryCache
+from http_client import configure_client
+from ingest import read_table
+from legcache import LegCache
+from metrics import collect, stage
+from routing import OSRMBackend
+
+# Scenari predefiniti: numero di giorni e intervallo di tappe per giorno
+SCENARIOS = {
+    "smoke": {"days": 5, "min_stops": 2, "max_stops": 8},
+    "month": {"days": 30, "min_stops": 2, "max_stops": 15},
+    "quarter": {"days": 90, "min_stops": 5, "max_stops": 20},
+    "year": {"days": 250, "min_stops": 2, "max_stops": 30},
+    "stress": {"days": 500, "min_stops": 2, "max_stops": 50},
+}
+
+
+def generate_csv(path, days, min_stops, max_stops, seed=0):
+    """
+    Scrive un CSV sintetico CASA;LAVORO;GIORNO. I clienti vengono estratti da
+    un insieme limitato, così che gli stessi indirizzi ricorrano tra i giorni
+    come nei dati reali.
+    """
+    rng = random.Random(seed)
+    clients = [f"Via Cliente {i}, Milano" for i in range(max(3 * max_stops, 100))]
+    rows = 0
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("CASA;LAVORO;GIORNO\n")
+        for day in range(days):
+            giorno = pd.Timestamp("2025-01-01") + pd.Timedelta(days=day)
+            for client in rng.sample(clients, rng.randint(min_stops, max_stops)):
+                f.write(f"Via Roma 1, Milano;{client};{giorno:%d/%m/%Y}\n")
+                rows += 1
+    return rows
+
+
+def run_scenario(name, days, min_stops, max_stops, args):
+    with tempfile.TemporaryDirectory() as tmp, \
+            StubServer(args.latency, args.jitter, args.error_rate, args.seed,
+                       args.error_status, args.transient_errors).start() as stub:
+        # Con i server finti non serve rispettare il limite di 1 richiesta/s di Nominatim
+        configure_client("nominatim", base_url=stub.url, rate=None)
+        configure_client("osrm", base_url=stub.url, rate=None)
+
+        csv_path = os.path.join(tmp, f"{name}.csv")
+        rows = generate_csv(csv_path, days, min_stops, max_stops, args.seed)
+
+        passes = []
+        geocode_cache = GeocodeCache(os.path.join(tmp, "geocode.sqlite3"))
+        leg_cache = LegCache(os.path.join(tmp, "legs.sqlite3"))
+        geometry_cache = GeometryCache(os.path.join(tmp, "geometry.sqlite3"))
+        for label in ["cold", "warm"] if args.warm else ["cold"]:
+            engine = RouteEngine(geocode_cache=geocode_cache, leg_cache=leg_cache, backend=OSRMBackend(),
+                                 geometry_cache=geometry_cache)
+            stub.stats.reset()
+
+            start = time.perf_counter()
+            with collect() as metrics:
+                with stage("csv_load"):
+                    df = read_table(csv_path)
+                results = list(engine.plan_days(split_days(df), args.objective, args.mode, args.workers))
+            wall = time.perf_counter() - start
+            snapshot = metrics.snapshot()
+
+            failed = sum(1 for _, result, _ in results if result is None)
+            partial = sum(1 for _, result, _ in results if result is not None and not is_complete(result))
+            total_km = sum(result["total_distance"] for _, result, _ in results if result is not None)
+            passes.append({
+                "pass": label,
+                "wall_seconds": round(wall, 4),
+                "stages": snapshot["stages"],
+                "counters": snapshot["counters"],
+                "http": stub.stats.snapshot(),
+                "days_failed": failed,
+                "days_estimated_legs": partial,
+                "total_km": round(total_km, 3),
+            })
+            engine.close()
+
+        return {"scenario": name, "days": days, "min_stops": min_stops, "max_stops": max_stops,
+                "rows": rows, "passes": passes}
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "commit": commit or None,
+    }
+
+
+def print_report(results):
+    header = f"{'scenario':<10}{'pass':<6}{'giorni':>7}{'righe':>8}{'tempo s':>10}{'geocod. s':>11}" \
+             f"{'matrice s':>11}{'solver s':>10}{'HTTP':>8}{'errori':>8}"
+    print(header)
+    print("-" * len(header))
+    for result in results:
+        for p in result["passes"]:
+            stages = p["stages"]
+            print(
+                f"{result['scenario']:<10}{p['pass']:<6}{result['days']:>7}{result['rows']:>8}"
+                f"{p['wall_seconds']:>10.3f}{stages.get('geocode', {}).get('seconds', 0):>11.3f}"
+                f"{stages.get('matrix', {}).get('seconds', 0):>11.3f}{stages.get('solve', {}).get('seconds', 0):>10.3f}"
+                f"{sum(p['http']['requests'].values()):>8}{p['http']['errors']:>8}"
+            )
+
+
+def compare(results, baseline, tolerance):
+    """Confronta con un'esecuzione precedente; restituisce la lista delle regressioni."""
+    previous = {(r["scenario"], p["pass"]): p for r in baseline["results"] for p in r["passes"]}
+    regressions = []
+    for result in results:
+        for p in result["passes"]:
+            old = previous.get((result["scenario"], p["pass"]))
+            if old is None:
+                continue
+            key = f"{result['scenario']}/{p['pass']}"
+            if p["wall_seconds"] > old["wall_seconds"] * (1 + tolerance):
+                regressions.append(f"{key}: tempo {old['wall_seconds']:.3f}s -> {p['wall_seconds']:.3f}s")
+            calls, old_calls = sum(p["http"]["requests"].values()), sum(old["http"]["requests"].values())
+            if calls > old_calls:
+                regressions.append(f"{key}: richieste HTTP {old_calls} -> {calls}")
+            if abs(p["total_km"] - old["total_km"]) > 1e-3:
+                regressions.append(f"{key}: km totali {old['total_km']} -> {p['total_km']}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark della pipeline contro server Nominatim/OSRM finti.")
+    parser.add_argument("--scenario", action="append", choices=list(SCENARIOS),
+                        help="scenario da eseguire (ripetibile); di default smoke e month")
+    parser.add_argument("--days", type=int, help="scenario personalizzato: numero di giorni")
+    parser.add_argument("--stops", type=int, nargs=2, metavar=("MIN", "MAX"),
+                        help="scenario personalizzato: tappe minime e massime per giorno")
+    parser.add_argument("--latency", type=float, default=0.0, help="latenza fissa dei server finti (s)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="latenza aggiuntiva massima casuale (s)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="frazione di richieste che falliscono")
+    parser.add_argument("--error-status", type=int, default=500, help="stato HTTP degli errori simulati (es. 429)")
+    parser.add_argument("--transient-errors", action="store_true",
+                        help="errori temporanei: ripetendo la richiesta può andare a buon fine")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--objective", choices=["distance", "duration"], default="distance")
+    parser.add_argument("--mode", choices=["exact", "hybrid", "estimate"], default="exact")
+    parser.add_argument("--workers", type=int, help="processi per il calcolo dei percorsi")
+    parser.add_argument("--warm", action="store_true", help="ripete ogni scenario con le cache già popolate")
+    parser.add_argument("-o", "--output", help="salva i risultati in questo file JSON")
+    parser.add_argument("--baseline", help="file JSON di un'esecuzione precedente da confrontare")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="peggioramento relativo del tempo tollerato nel confronto")
+    args = parser.parse_args(argv)
+
+    scenarios = [(name, SCENARIOS[name]) for name in args.scenario or []]
+    if args.days:
+        min_stops, max_stops = args.stops or (2, 10)
+        scenarios.append(("custom", {"days": args.days, "min_stops": min_stops, "max_stops": max_stops}))
+    if not scenarios:
+        scenarios = [(name, SCENARIOS[name]) for name in ("smoke", "month")]
+
+    results = [run_scenario(name, **params, args=args) for name, params in scenarios]
+    print_report(results)
+
+    report = {
+        "environment": environment(),
+        "settings": {k: v for k, v in vars(args).items() if k not in ("output", "baseline")},
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSIONE {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,201 @@
+"""
+Server HTTP locali che imitano Nominatim e OSRM, per i benchmark.
+
+Le risposte, la latenza e gli errori simulati dipendono solo dal seed e dal
+contenuto della richiesta, quindi sono riproducibili anche con richieste
+concorrenti.
+"""
+import hashlib
+import json
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from geometry import encode_polyline
+
+# Punti intermedi della geometria sintetica di una tratta
+GEOMETRY_POINTS = 50
+
+# Area in cui cadono gli indirizzi sintetici (dintorni di Milano)
+BBOX = (45.35, 9.05, 45.60, 9.35)
+
+CIRCUITY = 1.3
+SPEED_KMH = 40.0
+
+
+def _unit(seed, *parts):
+    # Numero pseudo-casuale in [0, 1) determinato da seed e parti della richiesta
+    digest = hashlib.sha256("|".join([str(seed), *map(str, parts)]).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") / 2 ** 64
+
+
+def _haversine_km(a, b):
+    lat1, lon1, lat2, lon2 = map(math.radians, (a[0], a[1], b[0], b[1]))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * 6371.0088 * math.asin(math.sqrt(min(1.0, h)))
+
+
+def stub_coords(address, seed=0):
+    """Coordinate sintetiche (lat, lon) di un indirizzo."""
+    lat = BBOX[0] + _unit(seed, "lat", address) * (BBOX[2] - BBOX[0])
+    lon = BBOX[1] + _unit(seed, "lon", address) * (BBOX[3] - BBOX[1])
+    return lat, lon
+
+
+def stub_geometry(a, b, seed=0):
+    """Geometria sintetica (lat, lon) di una tratta: una linea spezzata tra i due punti."""
+    points = []
+    for step in range(GEOMETRY_POINTS + 1):
+        t = step / GEOMETRY_POINTS
+        wobble = 0.002 * (_unit(seed, "geometry", a, b, step) - 0.5) if 0 < step < GEOMETRY_POINTS else 0
+        points.append((a[0] + t * (b[0] - a[0]) + wobble, a[1] + t * (b[1] - a[1]) - wobble))
+    return points
+
+
+def stub_leg(a, b, seed=0):
+    """Distanza (m) e durata (s) sintetiche di una tratta tra (lat, lon)."""
+    km = _haversine_km(a, b) * (CIRCUITY + 0.2 * _unit(seed, "leg", a, b))
+    return km * 1000, km / SPEED_KMH * 3600
+
+
+class StubStats:
+    """Contatori thread-safe delle richieste ricevute da un server finto."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = {}
+            self.errors = 0
+            self.bytes_sent = 0
+
+    def record(self, endpoint, size, error):
+        with self._lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+            self.bytes_sent += size
+            self.errors += int(error)
+
+    def snapshot(self):
+        with self._lock:
+            return {"requests": dict(self.requests), "errors": self.errors, "bytes_sent": self.bytes_sent}
+
+
+class StubServer:
+    """
+    Server finto Nominatim (/search) e OSRM (/route, /table) su una porta
+    locale libera, eseguito in un thread in background.
+
+    latency e jitter sono in secondi; error_rate è la frazione di richieste
+    che rispondono con l'errore HTTP error_status (500 di default; con 429
+    la risposta indica anche Retry-After). Con transient=True gli errori
+    sono temporanei: ripetendo la stessa richiesta l'esito viene estratto
+    di nuovo, altrimenti una richiesta che fallisce fallisce sempre.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, seed=0, error_status=500, transient=False):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.seed = seed
+        self.error_status = error_status
+        self.transient = transient
+        self.stats = StubStats()
+        self._attempts = {}
+        self._attempts_lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                parts = urlsplit(self.path)
+                endpoint = parts.path.split("/")[1]
+                delay = stub.latency + stub.jitter * _unit(stub.seed, "jitter", self.path)
+                if delay > 0:
+                    time.sleep(delay)
+
+                if stub.failing(self.path):
+                    status, body = stub.error_status, {"code": "Error", "message": "errore simulato"}
+                else:
+                    status, body = 200, stub.respond(endpoint, parts)
+
+                payload = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                if status == 429:
+                    self.send_header("Retry-After", "0")
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+                stub.stats.record(endpoint, len(payload), status != 200)
+
+        return Handler
+
+    def failing(self, path):
+        """Stabilisce se la richiesta deve fallire (sempre la stessa risposta, se non transient)."""
+        attempt = 0
+        if self.transient:
+            with self._attempts_lock:
+                attempt = self._attempts[path] = self._attempts.get(path, -1) + 1
+        return _unit(self.seed, "error", path, attempt) < self.error_rate
+
+    def respond(self, endpoint, parts):
+        query = parse_qs(parts.query)
+        if endpoint == "search":
+            lat, lon = stub_coords(query["q"][0], self.seed)
+            return [{"lat": str(lat), "lon": str(lon)}]
+
+        # OSRM: le coordinate sono nell'ultimo segmento del percorso, come lon,lat
+        points = [tuple(map(float, p.split(",")))[::-1] for p in parts.path.rsplit("/", 1)[1].split(";")]
+        if endpoint == "route":
+            distance, duration = stub_leg(points[0], points[1], self.seed)
+            route = {"distance": distance, "duration": duration}
+            if query.get("overview", ["simplified"])[0] != "false":
+                route["geometry"] = encode_polyline(stub_geometry(points[0], points[1], self.seed))
+            return {"code": "Ok", "routes": [route]}
+
+        if endpoint == "table":
+            sources = [int(i) for i in query["sources"][0].split(";")] if "sources" in query else range(len(points))
+            destinations = ([int(j) for j in query["destinations"][0].split(";")]
+                            if "destinations" in query else range(len(points)))
+            legs = [[stub_leg(points[i], points[j], self.seed) if i != j else (0, 0) for j in destinations]
+                    for i in sources]
+            return {
+                "code": "Ok",
+                "distances": [[leg[0] for leg in row] for row in legs],
+                "durations": [[leg[1] for leg in row] for row in legs],
+            }
+
+        return {"code": "InvalidUrl"}
@@ -0,0 +1,169 @@
+"""
+Calcolo dei percorsi ottimali da riga di comando, senza interfaccia Streamlit.
+
+Il file di input (CSV, Parquet o Excel) viene letto a blocchi e i giorni
+vengono pianificati e scritti a gruppi di dimensione fissa, quindi la memoria
+usata non cresce con il numero di giorni.
+Le righe di uno stesso giorno devono essere consecutive nel file.
+
+Esempio:
+    python cli.py indirizzi.csv -o risultati.csv
+    python cli.py indirizzi.csv -o risultati.parquet --objective duration
+"""
+import argparse
+import logging
+import os
+import sys
+
+import pandas as pd
+
+from engine import RouteEngine, format_day, split_days, summary_row
+from ingest import DEFAULT_CHUNKSIZE, iter_chunks
+from metrics import collect, log_metrics, stage
+
+logger = logging.getLogger("tragitto")
+
+# Giorni pianificati insieme (geocodifica e tratte condivise) prima di scrivere i risultati
+DEFAULT_BATCH_DAYS = 100
+
+
+def iter_csv_days(path, sep=None, chunksize=DEFAULT_CHUNKSIZE):
+    """
+    Legge il file a blocchi (vedi ingest.iter_chunks) e produce (giorno,
+    righe del giorno) appena le righe di un giorno sono complete.
+    """
+    pending_day, pending_frames = None, []
+    seen_days = set()
+
+    reader = iter_chunks(path, sep=sep, chunksize=chunksize)
+    while True:
+        with stage("csv_load"):
+            chunk = next(reader, None)
+        if chunk is None:
+            break
+
+        for giorno, day_df in split_days(chunk):
+            if giorno == pending_day:
+                pending_frames.append(day_df)
+                continue
+            if pending_frames:
+                yield pending_day, pd.concat(pending_frames)
+            if giorno in seen_days:
+                logger.warning("Le righe del giorno %s non sono consecutive: verrà calcolato più volte",
+                               format_day(giorno))
+            seen_days.add(giorno)
+            pending_day, pending_frames = giorno, [day_df]
+
+    if pending_frames:
+        yield pending_day, pd.concat(pending_frames)
+
+
+# Funzione per raggruppare i giorni in blocchi di dimensione limitata
+def iter_batches(days, size):
+    batch = []
+    for day in days:
+        batch.append(day)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class ResultWriter:
+    """Scrive le righe dei risultati in modo incrementale su CSV o Parquet."""
+
+    def __init__(self, path, sep=";"):
+        self.path = path
+        self.sep = sep
+        self.format = "parquet" if path.lower().endswith(".parquet") else "csv"
+        self._parquet_writer = None
+        self._header_written = False
+
+    def write(self, rows):
+        frame = pd.DataFrame(rows)
+        if self.format == "csv":
+            frame.to_csv(self.path, sep=self.sep, index=False, mode="a" if self._header_written else "w",
+                         header=not self._header_written)
+            self._header_written = True
+            return
+
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise RuntimeError("Per scrivere file Parquet è necessario installare pyarrow") from e
+
+        table = pa.Table.from_pandas(frame.astype({"Giorno": str}), preserve_index=False)
+        if self._parquet_writer is None:
+            self._parquet_writer = pq.ParquetWriter(self.path, table.schema)
+        self._parquet_writer.write_table(table)
+
+    def close(self):
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Calcola il tragitto ottimale casa -> lavori -> casa per ogni giorno.")
+    parser.add_argument("input", help="file CSV, Parquet o Excel con le colonne CASA, LAVORO e GIORNO")
+    parser.add_argument("-o", "--output", required=True, help="file dei risultati (.csv oppure .parquet)")
+    parser.add_argument("--sep", help="separatore del CSV di input (di default viene riconosciuto)")
+    parser.add_argument("--objective", choices=["distance", "duration"], default="distance",
+                        help="ottimizza il percorso per distanza o per tempo")
+    parser.add_argument("--mode", choices=["exact", "hybrid", "estimate"], default="exact",
+                        help="distanze tutte dal router, solo le tratte plausibili, oppure stima senza router")
+    parser.add_argument("--chunksize", type=int, default=DEFAULT_CHUNKSIZE,
+                        help="righe lette per blocco dal file di input")
+    parser.add_argument("--batch-days", type=int, default=DEFAULT_BATCH_DAYS,
+                        help="giorni pianificati insieme, condividendo geocodifica e tratte")
+    parser.add_argument("--workers", type=int, help="processi per il calcolo dei percorsi")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+
+    if os.path.exists(args.output):
+        os.remove(args.output)
+
+    engine = RouteEngine()
+    writer = ResultWriter(args.output)
+    giorni, giorni_falliti = 0, 0
+    distanza_totale_complessiva = 0
+    durata_totale_complessiva = 0
+
+    with collect() as metrics:
+        try:
+            days = iter_csv_days(args.input, args.sep, args.chunksize)
+            for batch in iter_batches(days, args.batch_days):
+                rows = []
+                for giorno, result, error in engine.plan_days(batch, args.objective, args.mode, args.workers):
+                    if error is not None:
+                        logger.error("%s", error)
+                        giorni_falliti += 1
+                        continue
+
+                    row = summary_row(result)
+                    row["Percorso"] = " -> ".join(str(result["addresses"][idx]) for idx in result["route"])
+                    rows.append(row)
+
+                    giorni += 1
+                    distanza_totale_complessiva += result["total_distance"]
+                    durata_totale_complessiva += result["total_duration"]
+                    logger.info("%s: %.2f km, %.0f min", format_day(giorno), result["total_distance"], result["total_duration"])
+                if rows:
+                    with stage("write"):
+                        writer.write(rows)
+        finally:
+            writer.close()
+            engine.close()
+
+    log_metrics("cli", metrics, input=args.input, objective=args.objective, mode=args.mode,
+                giorni=giorni, giorni_falliti=giorni_falliti)
+    print(f"Giorni calcolati: {giorni} (non calcolabili: {giorni_falliti})")
+    print(f"Distanza totale complessiva: {distanza_totale_complessiva:.2f} km")
+    print(f"Tempo totale stimato complessivo: {durata_totale_complessiva:.0f} minuti")
+    return 1 if giorni_falliti else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
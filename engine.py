@@ -0,0 +1,705 @@
+import datetime
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from estimate import DEFAULT_NEIGHBOURS, candidate_pairs, estimate_matrix, lower_bound_matrix
+from geocache import DEFAULT_CACHE_DIR, GeocodeCache
+from gazetteer import get_gazetteer
+from geocoding import geocode_many
+from geometry import GeometryCache
+from legcache import LegCache, quantize_coords
+from metrics import count, stage
+from routing import DEFAULT_TABLE_MAX_COORDS, get_backend
+from shared import get_flight
+from solver import solve_tour
+
+logger = logging.getLogger(__name__)
+
+REQUIRED_COLUMNS = ["CASA", "LAVORO", "GIORNO"]
+
+# Da questo numero di giorni i percorsi vengono calcolati in un pool di processi
+PARALLEL_MIN_DAYS = 8
+
+
+class EngineError(Exception):
+    """Errore nel calcolo del percorso di un giorno (il messaggio è mostrabile all'utente)."""
+
+
+class GeocodingError(EngineError):
+    pass
+
+
+class RoutingError(EngineError):
+    pass
+
+
+# Funzione per ottenere casa e lavori di un giorno dalle sue righe
+def day_addresses(day_df):
+    # Prendiamo il primo indirizzo casa come punto di partenza; le celle vuote non sono tappe
+    case = [address for address in day_df["CASA"].tolist() if is_address(address)]
+    casa_address = case[0] if case else day_df["CASA"].iloc[0]
+    lavoro_addresses = list(dict.fromkeys(address for address in day_df["LAVORO"].tolist() if is_address(address)))
+    return casa_address, lavoro_addresses
+
+
+# Funzione per stabilire se una cella contiene un indirizzo (non vuota né NaN)
+def is_address(value):
+    return not pd.isna(value) and bool(str(value).strip())
+
+
+# Funzione per calcolare un'impronta del contenuto di un giorno (casa, insieme dei lavori, opzioni)
+def day_fingerprint(casa_address, lavoro_addresses, objective="distance", mode="exact"):
+    content = json.dumps([str(casa_address), sorted(str(a) for a in lavoro_addresses), objective, mode])
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+# Funzione per calcolare distanza e durata totali lungo un percorso
+def route_totals(route, distances, durations):
+    route = np.asarray(route)
+    total_distance = float(distances[route[:-1], route[1:]].sum())
+    total_duration = float(durations[route[:-1], route[1:]].sum())
+    return total_distance, total_duration
+
+
+# Funzione per mostrare un giorno nel formato GG/MM/AAAA (i giorni non riconosciuti come date restano invariati)
+def format_day(giorno):
+    if isinstance(giorno, (pd.Timestamp, datetime.date)) and not pd.isna(giorno):
+        return giorno.strftime("%d/%m/%Y")
+    return giorno
+
+
+# Funzione per produrre la riga di riepilogo di un giorno
+def summary_row(result):
+    return {
+        "Giorno": format_day(result["giorno"]),
+        "Numero Lavori": len(result["lavoro_addresses"]),
+        "Distanza Totale (km)": round(result["total_distance"], 2),
+        "Tempo Stimato (min)": round(result["total_duration"], 0),
+        "Tratte Stimate": failed_leg_count(result),
+    }
+
+
+# Funzione per contare le tratte del percorso stimate perché il router non le ha restituite
+def failed_leg_count(result):
+    failed = result.get("failed")
+    if failed is None:
+        return 0
+    route = result["route"]
+    return int(sum(failed[a, b] for a, b in zip(route[:-1], route[1:])))
+
+
+# Funzione per stabilire se un risultato è definitivo (nessuna tratta sostituita da una stima
+# per un errore del router): i risultati non definitivi non vanno conservati, così al calcolo
+# successivo vengono richieste di nuovo solo le tratte fallite
+def is_complete(result):
+    failed = result.get("failed")
+    return failed is None or not failed.any()
+
+
+class RouteEngine:
+    """
+    Pipeline completa geocodifica → matrice delle distanze → percorso
+    ottimale → totali, indipendente dall'interfaccia utente.
+
+    Gli errori vengono segnalati con eccezioni EngineError il cui messaggio
+    può essere mostrato direttamente all'utente.
+    """
+
+    def __init__(self, geocode_cache=None, leg_cache=None, backend=None, gazetteer=None, geometry_cache=None):
+        self.backend = backend if backend is not None else get_backend()
+        self.gazetteer = gazetteer if gazetteer is not None else get_gazetteer()
+        self.geocode_cache = geocode_cache if geocode_cache is not None else GeocodeCache()
+        if leg_cache is None:
+            # Ogni motore ha la sua cache: le tratte di motori diversi non sono confrontabili
+            leg_cache = LegCache() if self.backend.name == "osrm" else LegCache(
+                os.path.join(DEFAULT_CACHE_DIR, f"legs-{self.backend.name}.sqlite3")
+            )
+        self.leg_cache = leg_cache
+        if geometry_cache is None:
+            geometry_cache = GeometryCache() if self.backend.name == "osrm" else GeometryCache(
+                os.path.join(DEFAULT_CACHE_DIR, f"geometry-{self.backend.name}.sqlite3")
+            )
+        self.geometry_cache = geometry_cache
+        self._process_pool = None
+        self._pool_lock = threading.Lock()
+
+    def close(self):
+        """Termina il pool di processi dei percorsi, se è stato creato (le cache restano aperte)."""
+        with self._pool_lock:
+            pool, self._process_pool = self._process_pool, None
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def geocode(self, addresses):
+        """Geocodifica gli indirizzi: {indirizzo: (lat, lon) oppure None}."""
+        with stage("geocode"):
+            results, errors = geocode_many(addresses, cache=self.geocode_cache, gazetteer=self.gazetteer)
+        for address, e in errors.items():
+            logger.warning("Errore durante la geocodifica di %s: %s", address, e)
+        return results
+
+    def fetch_legs(self, coords_list, pairs, dense=False, groups=None):
+        """
+        Ottiene distanza (km) e durata (minuti) delle tratte (i, j) indicate,
+        dalla cache delle tratte o dal router.
+
+        Restituisce {(i, j): (distanza, durata)}; le tratte non calcolabili
+        non compaiono. Con dense=True le tratte mancanti vengono chieste con
+        una sola richiesta /table sull'insieme di righe e colonne coinvolte.
+        Altrimenti vengono chieste a blocchi di gruppi interi di punti (es. i
+        punti di ciascun giorno, indicati da groups; di default un solo
+        gruppo con tutti i punti coinvolti), con una richiesta /table per ogni
+        blocco di al più DEFAULT_TABLE_MAX_COORDS punti; solo per i gruppi
+        più grandi si usa una richiesta /table per ogni origine. Le tratte già
+        richieste in questo momento da un altro thread (es. un'altra sessione)
+        non vengono richieste di nuovo, ma se ne attende il risultato.
+        """
+        with stage("matrix"):
+            return self._fetch_legs(coords_list, pairs, dense, groups)
+
+    def _fetch_legs(self, coords_list, pairs, dense, groups=None):
+        pairs = [(i, j) for i, j in pairs if i != j]
+        legs = {}
+
+        # Prima consultiamo la cache delle tratte già calcolate in passato
+        cached = self.leg_cache.get_many([(coords_list[i], coords_list[j]) for i, j in pairs])
+        for pos, leg in cached.items():
+            legs[pairs[pos]] = leg
+
+        missing = [pair for pair in pairs if pair not in legs]
+        count("leg_cache.hits", len(legs))
+        count("leg_cache.misses", len(missing))
+        if not missing:
+            return legs
+
+        flight = get_flight("legs")
+        keys = {pair: self._leg_key(coords_list, pair) for pair in missing}
+        owned, waiting = flight.claim(keys.values())
+        owned_set = set(owned)
+        mine = [pair for pair in missing if keys[pair] in owned_set]
+        count("legs.coalesced", len(missing) - len(mine))
+        try:
+            # Un altro thread può aver appena terminato le stesse tratte: controlla di nuovo la cache
+            cached = self.leg_cache.get_many([(coords_list[i], coords_list[j]) for i, j in mine])
+            for pos, leg in cached.items():
+                legs[mine[pos]] = leg
+            mine = [pair for pair in mine if pair not in legs]
+            if mine:
+                self._request_legs(coords_list, mine, dense, groups, legs)
+        finally:
+            flight.finish(owned, {keys[pair]: legs[pair] for pair in missing if pair in legs})
+
+        # Tratte richieste da altri thread: se ne attende il risultato
+        for pair in missing:
+            if keys[pair] in owned_set:
+                continue
+            try:
+                legs[pair] = waiting[keys[pair]].result()
+            except Exception:
+                count("legs.failed")
+        return legs
+
+    def _leg_key(self, coords_list, pair):
+        # Chiave di una tratta per l'unione delle richieste, valida tra chiamate con indici diversi
+        return (self.backend.name, quantize_coords(coords_list[pair[0]]), quantize_coords(coords_list[pair[1]]))
+
+    def _request_legs(self, coords_list, missing, dense, groups, legs):
+        # Richiede al router le tratte mancanti, aggiungendo a legs quelle calcolate
+        if dense:
+            # Una sola richiesta /table per le righe e colonne con tratte mancanti
+            table_dist, table_dur = self.backend.table(
+                coords_list,
+                sources=[i for i, _ in missing],
+                destinations=[j for _, j in missing],
+            )
+            for i, j in missing:
+                if not (np.isnan(table_dist[i, j]) or np.isnan(table_dur[i, j])):
+                    legs[i, j] = (table_dist[i, j], table_dur[i, j])
+        else:
+            # Richieste /table a blocchi di gruppi interi (es. più giorni per richiesta)
+            wanted = set(missing)
+            if groups is None:
+                groups = [sorted({point for pair in missing for point in pair})]
+            blocks = pack_blocks(groups, wanted)
+            small = [points for points in blocks if len(points) <= DEFAULT_TABLE_MAX_COORDS]
+            if small:
+                found = self.backend.table_blocks(coords_list, small)
+                legs.update((pair, leg) for pair, leg in found.items() if pair in wanted)
+
+            # Gruppi troppo grandi per una richiesta: una richiesta /table per ogni origine
+            destinations_by_source = {}
+            for points in blocks:
+                if len(points) <= DEFAULT_TABLE_MAX_COORDS:
+                    continue
+                inside = set(points)
+                for i, j in missing:
+                    if i in inside and j in inside:
+                        destinations_by_source.setdefault(i, []).append(j)
+            if destinations_by_source:
+                legs.update(self.backend.table_rows(coords_list, destinations_by_source))
+
+        # Le coppie ancora mancanti vengono calcolate singolarmente (in parallelo) con /route
+        fallback = [pair for pair in missing if pair not in legs]
+        count("legs.route_fallback", len(fallback))
+        results = self.backend.routes([(coords_list[i], coords_list[j]) for i, j in fallback])
+        failed = 0
+        for (i, j), result in zip(fallback, results):
+            if isinstance(result, Exception):
+                logger.warning("Percorso %d -> %d non calcolabile: %s", i, j, result)
+                failed += 1
+                continue
+            legs[i, j] = result
+        count("legs.failed", failed)
+
+        self.leg_cache.store_many([
+            (coords_list[i], coords_list[j], legs[i, j][0], legs[i, j][1])
+            for i, j in missing
+            if (i, j) in legs
+        ])
+
+    def distance_matrix(self, coords_list, pairs=None):
+        """
+        Calcola le matrici di distanze (km) e durate (minuti) tra i punti,
+        usando la cache delle tratte e il router per quelle mancanti.
+
+        Di default vengono calcolate tutte le tratte, con una sola richiesta
+        /table; con pairs solo le tratte (i, j) indicate. Le altre celle e le
+        tratte che il router non ha restituito restano NaN.
+        """
+        n = len(coords_list)
+        dense = pairs is None
+        if dense:
+            pairs = [(i, j) for i in range(n) for j in range(n) if i != j]
+
+        legs = self.fetch_legs(coords_list, pairs, dense=dense)
+        return slice_legs(legs, list(range(n)))
+
+    def solve(self, distances, durations, objective="distance"):
+        """Percorso ottimale casa -> lavori -> casa (casa è sempre indice 0)."""
+        with stage("solve"):
+            return solve_tour(objective_matrix(distances, durations, objective))
+
+    def solve_many(self, matrices, max_workers=None):
+        """
+        Risolve più giorni {chiave: matrice} e restituisce {chiave: percorso}.
+
+        Con almeno PARALLEL_MIN_DAYS giorni i percorsi vengono calcolati in
+        parallelo in un pool di processi.
+        """
+        return dict(self.iter_solve(matrices, max_workers))
+
+    def iter_solve(self, matrices, max_workers=None):
+        """
+        Come solve_many, ma produce (chiave, percorso) nell'ordine delle
+        chiavi man mano che ciascun percorso è calcolato.
+        """
+        keys = list(matrices)
+        if len(matrices) < PARALLEL_MIN_DAYS or max_workers == 1:
+            routes = (solve_tour(matrices[key]) for key in keys)
+        else:
+            routes = self._get_process_pool(max_workers).map(solve_tour, [matrices[key] for key in keys])
+        for key in keys:
+            with stage("solve"):
+                route = next(routes)
+            yield key, route
+
+    def _get_process_pool(self, max_workers):
+        # Un solo pool per motore, anche se più sessioni lo usano insieme
+        with self._pool_lock:
+            if self._process_pool is None:
+                # "spawn" evita di duplicare con fork i thread del client HTTP
+                self._process_pool = ProcessPoolExecutor(
+                    max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._process_pool
+
+    def hybrid_solve(self, coords_list, objective="distance", k=DEFAULT_NEIGHBOURS):
+        """
+        Percorso ottimale chiedendo al router solo le tratte plausibili.
+
+        La stima in linea d'aria indica per ogni punto i k vicini più
+        prossimi: vengono richieste solo quelle tratte (più quelle da e verso
+        casa). Per le altre il risolutore usa un limite inferiore (linea
+        d'aria, velocità massima); se il percorso trovato usa una di queste
+        tratte, le tratte ancora stimate vengono richieste al router e il
+        percorso ricalcolato.
+        Quando il percorso usa solo tratte reali nessun altro percorso può
+        costare meno, purché il router non sposti gli estremi delle tratte
+        oltre SNAP_TOLERANCE_KM: in quel caso il risultato può differire da
+        quello della modalità esatta. Le tratte richieste ma non restituite
+        dal router valgono la stima in linea d'aria.
+
+        Restituisce distanze, durate, percorso, la maschera delle tratte
+        stimate e quella delle tratte stimate per un errore del router.
+        """
+        est_distances, est_durations = estimate_matrix(coords_list)
+        min_distances, min_durations = lower_bound_matrix(coords_list)
+        pairs = candidate_pairs(est_distances, k)
+        distances, durations = self.distance_matrix(coords_list, pairs)
+        requested = pairs_mask(len(coords_list), pairs)
+
+        while True:
+            estimated = np.isnan(distances)
+            failed = estimated & requested
+            route = self.solve(
+                bounded_matrix(distances, estimated, failed, min_distances, est_distances),
+                bounded_matrix(durations, estimated, failed, min_durations, est_durations),
+                objective,
+            )
+            if not any(estimated[a, b] and not failed[a, b] for a, b in zip(route[:-1], route[1:])):
+                break
+            # Si chiedono tutte le tratte ancora stimate: stanno nella stessa richiesta /table
+            unknown = [(int(a), int(b)) for a, b in zip(*np.nonzero(estimated & ~failed))]
+            leg_dist, leg_dur = self.distance_matrix(coords_list, unknown)
+            for a, b in unknown:
+                requested[a, b] = True
+                distances[a, b], durations[a, b] = leg_dist[a, b], leg_dur[a, b]
+
+        # Le tratte mai richieste o non restituite vengono restituite con la stima
+        return (
+            np.where(estimated, est_distances, distances),
+            np.where(estimated, est_durations, durations),
+            route,
+            estimated,
+            failed,
+        )
+
+    def route_geometry(self, coords_list, route):
+        """
+        Geometria [(lat, lon), ...] di ogni tratta del percorso, dalla cache
+        o dal router; viene richiesta solo per le tratte del percorso scelto.
+        Le tratte la cui geometria non è disponibile sono segmenti rettilinei.
+        """
+        with stage("geometry"):
+            pairs = [(coords_list[a], coords_list[b]) for a, b in zip(route[:-1], route[1:])]
+            geometries = self.geometry_cache.get_many(pairs)
+            count("geometry_cache.hits", len(geometries))
+
+            missing = [pos for pos in range(len(pairs)) if pos not in geometries]
+            count("geometry_cache.misses", len(missing))
+            fetched = []
+            for pos, result in zip(missing, self.backend.route_geometries([pairs[pos] for pos in missing])):
+                if isinstance(result, Exception):
+                    logger.warning("Geometria della tratta %d non disponibile: %s", pos, result)
+                    geometries[pos] = [tuple(pairs[pos][0]), tuple(pairs[pos][1])]
+                    continue
+                geometries[pos] = result
+                fetched.append((pairs[pos][0], pairs[pos][1], result))
+            self.geometry_cache.store_many(fetched)
+            return [geometries[pos] for pos in range(len(pairs))]
+
+    def locate_day(self, giorno, casa_address, lavoro_addresses, geocoded=None):
+        """Coordinate di casa e dei lavori di un giorno, con casa in prima posizione."""
+        if not is_address(casa_address):
+            raise GeocodingError(f"Indirizzo di casa mancante per il giorno {format_day(giorno)}")
+        if geocoded is None:
+            geocoded = self.geocode([casa_address] + lavoro_addresses)
+
+        coords_casa = geocoded.get(casa_address)
+        if coords_casa is None:
+            raise GeocodingError(f"Impossibile geocodificare l'indirizzo di casa per il giorno {format_day(giorno)}: {casa_address}")
+
+        coords_lavoro_list = []
+        for addr in lavoro_addresses:
+            coords = geocoded.get(addr)
+            if coords is None:
+                raise GeocodingError(f"Impossibile geocodificare l'indirizzo di lavoro per il giorno {format_day(giorno)}: {addr}")
+            coords_lavoro_list.append(coords)
+
+        return [coords_casa] + coords_lavoro_list
+
+    def plan_day(self, giorno, casa_address, lavoro_addresses, objective="distance", mode="exact"):
+        """
+        Calcola il percorso ottimale di un giorno.
+
+        mode può essere "exact" (tutte le tratte dal router), "estimate"
+        (stima in linea d'aria, nessuna richiesta al router) oppure "hybrid"
+        (solo le tratte plausibili dal router, vedi hybrid_solve).
+
+        Le tratte che il router non restituisce (anche dopo i tentativi
+        ripetuti del client HTTP) non interrompono il calcolo: valgono la
+        stima in linea d'aria e sono segnate nella maschera "failed".
+
+        Restituisce un dizionario con indirizzi, coordinate, matrici,
+        percorso (lista di indici) e totali.
+        """
+        all_coords = self.locate_day(giorno, casa_address, lavoro_addresses)
+        n = len(all_coords)
+
+        try:
+            if mode == "estimate":
+                distances, durations = estimate_matrix(all_coords)
+                estimated = ~np.eye(n, dtype=bool)
+                failed = np.zeros((n, n), dtype=bool)
+                route = self.solve(distances, durations, objective)
+            elif mode == "hybrid":
+                distances, durations, route, estimated, failed = self.hybrid_solve(all_coords, objective)
+            else:
+                distances, durations = self.distance_matrix(all_coords)
+                estimated = failed = np.isnan(distances)
+                distances, durations = fill_failed(all_coords, distances, durations, failed)
+                route = self.solve(distances, durations, objective)
+        except RoutingError as e:
+            raise RoutingError(f"Impossibile calcolare la matrice delle distanze per il giorno {format_day(giorno)}. {e}") from e
+
+        return day_result(giorno, casa_address, lavoro_addresses, all_coords,
+                          distances, durations, estimated, mode, route, failed)
+
+    def plan_days(self, day_frames, objective="distance", mode="exact", max_workers=None):
+        """
+        Calcola i percorsi di più giorni insieme, a partire da una sequenza di
+        (giorno, righe del giorno).
+
+        Gli indirizzi di tutti i giorni vengono geocodificati una sola volta e
+        le tratte necessarie a tutti i giorni vengono raccolte in un unico
+        deposito globale, da cui si ritagliano le matrici dei singoli giorni;
+        i percorsi vengono poi calcolati in parallelo (vedi iter_solve).
+
+        Per ogni giorno, nell'ordine di ingresso, produce (giorno, risultato,
+        errore) appena il suo percorso è calcolato: uno dei due è None. Come
+        in plan_day, le tratte che il router non restituisce valgono la stima
+        in linea d'aria.
+        """
+        days = [(giorno, *day_addresses(day_df)) for giorno, day_df in day_frames if not day_df.empty]
+        errors = {}
+
+        # Geocodifica unica di tutti gli indirizzi del file
+        geocoded = self.geocode(list(dict.fromkeys(
+            address for _, casa_address, lavoro_addresses in days for address in [casa_address] + lavoro_addresses
+            if is_address(address)
+        )))
+
+        # Punti globali: ogni coordinata distinta ha un solo indice
+        points = {}
+        day_coords, day_points = {}, {}
+        for pos, (giorno, casa_address, lavoro_addresses) in enumerate(days):
+            try:
+                coords = self.locate_day(giorno, casa_address, lavoro_addresses, geocoded)
+            except GeocodingError as e:
+                errors[pos] = e
+                continue
+            day_coords[pos] = coords
+            day_points[pos] = [points.setdefault(tuple(c), len(points)) for c in coords]
+        global_coords = list(points)
+
+        # Deposito globale delle tratte, richieste una sola volta per tutti i giorni
+        legs = {}
+        needed = set()
+        if mode != "estimate":
+            for pos, idx in day_points.items():
+                if mode == "hybrid":
+                    local_pairs = candidate_pairs(estimate_matrix(day_coords[pos])[0])
+                else:
+                    local_pairs = [(a, b) for a in range(len(idx)) for b in range(len(idx)) if a != b]
+                needed.update((idx[a], idx[b]) for a, b in local_pairs if idx[a] != idx[b])
+            # Richieste /table a blocchi di giorni interi (in modalità ibrida solo le tratte candidate)
+            legs = self.fetch_legs(global_coords, sorted(needed), groups=list(day_points.values()))
+
+        matrices = {}
+        for pos in day_points:
+            giorno = days[pos][0]
+            if mode == "estimate":
+                distances, durations = estimate_matrix(day_coords[pos])
+                estimated = ~np.eye(len(day_coords[pos]), dtype=bool)
+            else:
+                distances, durations = slice_legs(legs, day_points[pos])
+                estimated = np.isnan(distances)
+                if mode == "exact":
+                    distances, durations = fill_failed(day_coords[pos], distances, durations, estimated)
+            matrices[pos] = (distances, durations, estimated)
+
+        routes = self._solve_days(matrices, global_coords, day_coords, day_points, legs, needed,
+                                  objective, mode, max_workers)
+
+        for pos, (giorno, casa_address, lavoro_addresses) in enumerate(days):
+            if pos in errors:
+                yield giorno, None, errors[pos]
+                continue
+            _, route = next(routes)
+            distances, durations, estimated = matrices[pos]
+            failed = estimated & requested_mask(day_points[pos], needed)
+            if mode == "hybrid":
+                # Le tratte mai richieste o non restituite vengono restituite con la stima
+                distances, durations = fill_failed(day_coords[pos], distances, durations, estimated)
+            yield giorno, day_result(giorno, casa_address, lavoro_addresses, day_coords[pos],
+                                     distances, durations, estimated, mode, route, failed), None
+
+    def _solve_days(self, matrices, global_coords, day_coords, day_points, legs, requested,
+                    objective, mode, max_workers):
+        # Produce (pos, percorso) per i giorni, nell'ordine di ingresso, appena il percorso
+        # di ciascuno è definitivo. In modalità ibrida richiede le tratte stimate usate dai
+        # percorsi e ricalcola i giorni interessati finché non ce ne sono più: un giorno
+        # da ricalcolare trattiene i successivi fino al giro seguente.
+        # requested (tratte già richieste al router) viene aggiornato
+        if mode != "hybrid":
+            yield from self.iter_solve({
+                pos: objective_matrix(distances, durations, objective)
+                for pos, (distances, durations, _) in matrices.items()
+            }, max_workers)
+            return
+
+        lower_bounds = {pos: lower_bound_matrix(day_coords[pos]) for pos in matrices}
+        estimates = {pos: estimate_matrix(day_coords[pos]) for pos in matrices}
+        order = list(matrices)
+        routes = {}
+        next_pos = 0
+        pending = order
+        while pending:
+            # Le tratte già richieste e non restituite dal router valgono la stima
+            failed = {pos: matrices[pos][2] & requested_mask(day_points[pos], requested) for pos in pending}
+            solved = self.iter_solve({
+                pos: objective_matrix(
+                    bounded_matrix(matrices[pos][0], matrices[pos][2], failed[pos],
+                                   lower_bounds[pos][0], estimates[pos][0]),
+                    bounded_matrix(matrices[pos][1], matrices[pos][2], failed[pos],
+                                   lower_bounds[pos][1], estimates[pos][1]),
+                    objective,
+                )
+                for pos in pending
+            }, max_workers)
+
+            # Per i giorni il cui percorso usa tratte stimate si chiedono tutte le tratte
+            # ancora stimate del giorno: stanno comunque nella stessa richiesta /table
+            unknown = {}
+            last_routes = {}
+            for pos, route in solved:
+                idx = day_points[pos]
+                unknown_legs = matrices[pos][2] & ~failed[pos]
+                if any(unknown_legs[a, b] for a, b in zip(route[:-1], route[1:])):
+                    unknown[pos] = [(idx[a], idx[b]) for a, b in zip(*np.nonzero(unknown_legs)) if idx[a] != idx[b]]
+                    last_routes[pos] = route
+                    continue
+                routes[pos] = route
+                while next_pos < len(order) and order[next_pos] in routes:
+                    yield order[next_pos], routes.pop(order[next_pos])
+                    next_pos += 1
+
+            new_pairs = sorted({pair for pairs in unknown.values() for pair in pairs} - requested)
+            if not new_pairs:
+                routes.update(last_routes)
+                break
+            requested.update(new_pairs)
+            pending = list(unknown)
+            legs.update(self.fetch_legs(global_coords, new_pairs, groups=[day_points[pos] for pos in pending]))
+
+            for pos in pending:
+                distances, durations = slice_legs(legs, day_points[pos])
+                matrices[pos] = (distances, durations, np.isnan(distances))
+
+        for pos in order[next_pos:]:
+            yield pos, routes[pos]
+
+
+# Funzione per raggruppare i gruppi di punti con tratte mancanti in blocchi di al più
+# max_coords punti, da chiedere con una sola richiesta /table ciascuno
+def pack_blocks(groups, missing, max_coords=DEFAULT_TABLE_MAX_COORDS):
+    blocks = []
+    current = set()
+    for points in groups:
+        involved = {point for i in points for j in points if (i, j) in missing for point in (i, j)}
+        if not involved:
+            continue
+        if current and len(current | involved) > max_coords:
+            blocks.append(sorted(current))
+            current = set()
+        current |= involved
+    if current:
+        blocks.append(sorted(current))
+    return blocks
+
+
+# Funzione per scegliere la matrice da ottimizzare
+def objective_matrix(distances, durations, objective="distance"):
+    return durations if objective == "duration" else distances
+
+
+# Funzione per sostituire con la stima in linea d'aria le tratte indicate dalla maschera
+def fill_failed(coords_list, distances, durations, failed):
+    if not failed.any():
+        return distances, durations
+    est_distances, est_durations = estimate_matrix(coords_list)
+    return np.where(failed, est_distances, distances), np.where(failed, est_durations, durations)
+
+
+# Funzione per preparare la matrice da ottimizzare in modalità ibrida: le tratte mai
+# richieste valgono il limite inferiore, quelle non restituite dal router la stima
+def bounded_matrix(values, estimated, failed, lower_bound, estimate):
+    return np.where(failed, estimate, np.where(estimated, lower_bound, values))
+
+
+# Funzione per ottenere la maschera n x n delle tratte (i, j) indicate
+def pairs_mask(n, pairs):
+    mask = np.zeros((n, n), dtype=bool)
+    for i, j in pairs:
+        mask[i, j] = True
+    return mask
+
+
+# Funzione per ottenere la maschera delle tratte tra i punti indicati presenti in un insieme di tratte globali
+def requested_mask(points, requested):
+    n = len(points)
+    mask = np.zeros((n, n), dtype=bool)
+    for a, i in enumerate(points):
+        for b, j in enumerate(points):
+            mask[a, b] = i != j and (i, j) in requested
+    return mask
+
+
+# Funzione per ritagliare da un deposito di tratte {(i, j): (distanza, durata)} le
+# matrici dei punti indicati; le tratte mancanti restano NaN
+def slice_legs(legs, points):
+    n = len(points)
+    distances = np.full((n, n), np.nan)
+    durations = np.full((n, n), np.nan)
+    for a, i in enumerate(points):
+        for b, j in enumerate(points):
+            if i == j:
+                distances[a, b] = durations[a, b] = 0
+                continue
+            leg = legs.get((i, j))
+            if leg is not None:
+                distances[a, b], durations[a, b] = leg
+    return distances, durations
+
+
+# Funzione per comporre il risultato di un giorno
+def day_result(giorno, casa_address, lavoro_addresses, all_coords, distances, durations, estimated, mode, route,
+               failed=None):
+    if failed is None:
+        failed = np.zeros_like(estimated)
+    with stage("totals"):
+        total_distance, total_duration = route_totals(route, distances, durations)
+    return {
+        "giorno": giorno,
+        "casa_address": casa_address,
+        "lavoro_addresses": lavoro_addresses,
+        "addresses": [casa_address] + lavoro_addresses,
+        "coords": all_coords,
+        "distances": distances,
+        "durations": durations,
+        "estimated": estimated,
+        "failed": failed,
+        "mode": mode,
+        "route": route,
+        "total_distance": total_distance,
+        "total_duration": total_duration,
+    }
+
+
+# Funzione per dividere un DataFrame nei gruppi di righe di ciascun giorno (in ordine di apparizione)
+def split_days(df):
+    return df.groupby("GIORNO", sort=False, observed=True)
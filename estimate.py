@@ -0,0 +1,78 @@
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+
+# Rapporto medio tra distanza stradale e distanza in linea d'aria
+DEFAULT_CIRCUITY_FACTOR = 1.3
+
+# Velocità media usata per stimare le durate (km/h)
+DEFAULT_AVERAGE_SPEED_KMH = 45.0
+
+# Velocità massima plausibile su strada (km/h), per le durate minime
+MAX_SPEED_KMH = 130.0
+
+# Spostamento massimo previsto (km) di ciascun estremo quando il router lo aggancia
+# alla rete stradale: una tratta reale può essere più corta della linea d'aria
+# tra i punti originali fino al doppio di questa distanza
+SNAP_TOLERANCE_KM = 0.5
+
+# Numero di vicini per punto per cui chiedere la distanza reale in modalità ibrida
+DEFAULT_NEIGHBOURS = 5
+
+
+def haversine_matrix(coords_list):
+    """Matrice delle distanze in linea d'aria (km) tra tutti i punti (lat, lon)."""
+    coords = np.radians(np.asarray(coords_list, dtype=float).reshape(-1, 2))
+    lat = coords[:, 0][:, None]
+    lon = coords[:, 1][:, None]
+    dlat = lat - lat.T
+    dlon = lon - lon.T
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat) * np.cos(lat.T) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def estimate_matrix(coords_list, circuity=DEFAULT_CIRCUITY_FACTOR, speed_kmh=DEFAULT_AVERAGE_SPEED_KMH):
+    """
+    Stima istantanea delle matrici di distanze (km) e durate (minuti),
+    senza richieste HTTP: distanza in linea d'aria per il fattore di
+    tortuosità stradale, percorsa a velocità media costante.
+    """
+    distances = haversine_matrix(coords_list) * circuity
+    durations = distances / speed_kmh * 60
+    return distances, durations
+
+
+def lower_bound_matrix(coords_list, max_speed_kmh=MAX_SPEED_KMH, snap_tolerance_km=SNAP_TOLERANCE_KM):
+    """
+    Limiti inferiori delle matrici di distanze (km) e durate (minuti): nessun
+    percorso stradale è più corto della linea d'aria, ridotta dello
+    spostamento dei due estremi agganciati alla rete (snap_tolerance_km
+    ciascuno), né più veloce di max_speed_kmh.
+    """
+    distances = np.maximum(haversine_matrix(coords_list) - 2 * snap_tolerance_km, 0)
+    durations = distances / max_speed_kmh * 60
+    return distances, durations
+
+
+def candidate_pairs(distances, k=DEFAULT_NEIGHBOURS):
+    """
+    Tratte che il percorso ottimale può plausibilmente usare: per ogni punto
+    quelle verso e dai suoi k vicini più prossimi secondo la stima, più
+    tutte le tratte da e verso casa (indice 0).
+    """
+    n = distances.shape[0]
+    pairs = set()
+    if n <= 1:
+        return []
+
+    k = min(k, n - 1)
+    masked = distances + np.diag(np.full(n, np.inf))
+    neighbours = np.argsort(masked, axis=1)[:, :k]
+    for i in range(n):
+        for j in neighbours[i]:
+            pairs.add((i, int(j)))
+            pairs.add((int(j), i))
+    for j in range(1, n):
+        pairs.add((0, j))
+        pairs.add((j, 0))
+    return sorted(pairs)
@@ -0,0 +1,308 @@
+"""
+Stradario locale per geocodificare gli indirizzi senza Nominatim.
+
+Lo stradario si importa da un CSV con le colonne COMUNE, VIA, CIVICO
+(facoltativa, vuota per il punto generico della via), LAT e LON:
+
+    python gazetteer.py stradario.csv -o stradario.sqlite3
+
+e si usa impostando TRAGITTO_GAZETTEER=stradario.sqlite3. Gli indirizzi
+vengono confrontati dopo la normalizzazione (maiuscole, accenti,
+abbreviazioni come "V." o "P.zza"); se la via non è presente in forma
+esatta viene cercata la più simile nello stesso comune (confrontando i nomi
+senza tipo di strada); se nessuna è nettamente più simile delle altre
+l'indirizzo viene lasciato a Nominatim. Per un civico non
+presente la posizione viene interpolata tra i civici noti dello stesso lato
+della strada.
+"""
+import argparse
+import difflib
+import logging
+import os
+import re
+import sqlite3
+import unicodedata
+from bisect import bisect_left
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Abbreviazioni comuni nei toponimi italiani (senza punti e in minuscolo: "P.zza" -> "pzza")
+ABBREVIATIONS = {
+    "v": "via", "vle": "viale", "vl": "viale",
+    "pza": "piazza", "pzza": "piazza", "piaz": "piazza",
+    "ple": "piazzale", "pzle": "piazzale",
+    "cso": "corso",
+    "lgo": "largo",
+    "str": "strada", "sda": "strada",
+    "vic": "vicolo", "vlo": "vicolo",
+    "loc": "localita", "fraz": "frazione",
+    "s": "san", "sto": "santo", "sta": "santa",
+}
+
+# Tipi di strada, usati per riconoscere la via anche quando il tipo manca o è diverso
+STREET_TYPES = {
+    "via", "viale", "piazza", "piazzale", "piazzetta", "corso", "largo", "strada", "vicolo",
+    "localita", "frazione", "contrada", "borgo", "lungomare", "lungolago", "galleria", "salita",
+}
+
+# Parti dell'indirizzo da ignorare (nazione)
+IGNORED_WORDS = {"italia", "italy"}
+
+# Somiglianza minima (sul nome senza tipo di strada) per accettare una via con nome non identico,
+# e distacco minimo dalla seconda via più simile: nel dubbio l'indirizzo va a Nominatim
+FUZZY_CUTOFF = 0.88
+FUZZY_MARGIN = 0.05
+
+_NUMBER_RE = re.compile(r"^(\d+)(?:\s*[a-z]|/\w+)?$")
+
+
+# Funzione per normalizzare un toponimo: minuscole, senza accenti né punteggiatura, abbreviazioni espanse
+def normalize_name(text):
+    text = unicodedata.normalize("NFKD", str(text)).encode("ascii", "ignore").decode("ascii").casefold()
+    words = []
+    for word in re.split(r"[\s\-'’]+", text):
+        word = word.strip(",;:()\"").replace(".", "")
+        word = ABBREVIATIONS.get(word, word)
+        if word:
+            words.append(word)
+    return " ".join(words)
+
+
+# Funzione per togliere il tipo di strada dal nome ("via roma" -> "roma")
+def street_core(street):
+    words = street.split(" ")
+    return " ".join(words[1:]) if len(words) > 1 and words[0] in STREET_TYPES else street
+
+
+# Funzione per interpretare un numero civico ("12", "12a", "12/b") come intero
+def parse_house_number(value):
+    if value is None or (isinstance(value, float) and value != value):
+        return None
+    match = _NUMBER_RE.match(str(value).strip().casefold())
+    return int(match.group(1)) if match else None
+
+
+def split_address(address, comuni=()):
+    """
+    Scompone un indirizzo libero in (comune, via, civico) normalizzati.
+    Il comune viene riconosciuto tra quelli noti (comuni); CAP, sigla della
+    provincia e nazione vengono ignorati. Le parti non trovate sono None.
+    """
+    text = unicodedata.normalize("NFKC", str(address))
+    text = re.sub(r"\(\s*[A-Za-z]{2}\s*\)", " ", text)  # provincia tra parentesi
+    text = re.sub(r"\b\d{5}\b", " ", text)  # CAP
+    parts = [normalize_name(part) for part in re.split(r"[,;\n]|\s-\s", text)]
+    parts = [part for part in parts if part and part not in IGNORED_WORDS]
+
+    comune = None
+    for pos in range(len(parts) - 1, -1, -1):
+        candidate = re.sub(r"\s+[a-z]{2}$", "", parts[pos]) if parts[pos] not in comuni else parts[pos]
+        if candidate in comuni and pos > 0:
+            comune = candidate
+            del parts[pos]
+            break
+    if comune is None and parts:
+        # Indirizzo senza virgole: il comune è la parte finale dell'ultima parte ("via roma 1 milano")
+        words = parts[-1].split(" ")
+        for size in range(min(4, len(words) - 1), 0, -1):
+            candidate = " ".join(words[-size:])
+            if candidate in comuni:
+                comune = candidate
+                parts[-1] = " ".join(words[:-size])
+                break
+
+    number = None
+    street = None
+    for part in parts:
+        if number is None and parse_house_number(part) is not None:
+            number = parse_house_number(part)
+            continue
+        if street is None:
+            words = part.split(" ")
+            if len(words) > 1 and parse_house_number(words[-1]) is not None:
+                number = parse_house_number(words[-1])
+                words = words[:-1]
+            street = " ".join(words)
+    return comune, street, number
+
+
+class Street:
+    """Punti noti di una via: civici ordinati e punto generico (centroide)."""
+
+    def __init__(self, points):
+        numbered = sorted((number, lat, lon) for number, lat, lon in points if number is not None)
+        generic = [(lat, lon) for number, lat, lon in points if number is None] or [
+            (lat, lon) for _, lat, lon in numbered
+        ]
+        self.numbers = [p[0] for p in numbered]
+        self.coords = [(p[1], p[2]) for p in numbered]
+        self.centroid = (sum(p[0] for p in generic) / len(generic), sum(p[1] for p in generic) / len(generic))
+
+    def locate(self, number=None):
+        """Coordinate del civico, interpolate tra i civici vicini dello stesso lato se non presente."""
+        if number is None or not self.numbers:
+            return self.centroid
+
+        # Prima i civici dello stesso lato (pari o dispari), poi tutti
+        for same_side in (True, False):
+            numbers, coords = self.numbers, self.coords
+            if same_side:
+                side = [pos for pos, n in enumerate(numbers) if n % 2 == number % 2]
+                if not side:
+                    continue
+                numbers, coords = [numbers[pos] for pos in side], [coords[pos] for pos in side]
+            pos = bisect_left(numbers, number)
+            if pos < len(numbers) and numbers[pos] == number:
+                return coords[pos]
+            if pos == 0:
+                return coords[0]
+            if pos == len(numbers):
+                return coords[-1]
+            low, high = numbers[pos - 1], numbers[pos]
+            t = (number - low) / (high - low)
+            (lat1, lon1), (lat2, lon2) = coords[pos - 1], coords[pos]
+            return lat1 + t * (lat2 - lat1), lon1 + t * (lon2 - lon1)
+        return self.centroid
+
+
+class Gazetteer:
+    """
+    Stradario in memoria: per ogni comune le sue vie, indicizzate sul nome
+    normalizzato e sul nome senza tipo di strada.
+    """
+
+    def __init__(self, rows):
+        # rows: sequenza di (comune, via, civico, lat, lon) già normalizzati
+        grouped = {}
+        for comune, street, number, lat, lon in rows:
+            grouped.setdefault(comune, {}).setdefault(street, []).append((number, lat, lon))
+
+        self.streets = {
+            comune: {street: Street(points) for street, points in streets.items()}
+            for comune, streets in grouped.items()
+        }
+        self.cores = {}
+        for comune, streets in self.streets.items():
+            cores = self.cores[comune] = {}
+            for street in streets:
+                cores.setdefault(street_core(street), []).append(street)
+        self.comuni = set(self.streets)
+
+    @classmethod
+    def from_csv(cls, path, sep=None, chunksize=100000):
+        """Importa uno stradario CSV con le colonne COMUNE, VIA, CIVICO (facoltativa), LAT e LON."""
+        from ingest import read_header, sniff_separator
+
+        sep = sep or sniff_separator(read_header(path))
+        rows = []
+        for chunk in pd.read_csv(path, sep=sep, chunksize=chunksize, dtype=str, encoding="utf-8-sig"):
+            chunk.columns = chunk.columns.str.strip().str.upper()
+            if "VIA" not in chunk.columns:
+                chunk = chunk.rename(columns={"STRADA": "VIA", "INDIRIZZO": "VIA"})
+            missing = [col for col in ("COMUNE", "VIA", "LAT", "LON") if col not in chunk.columns]
+            if missing:
+                raise ValueError(f"Colonne mancanti nello stradario: {', '.join(missing)}")
+            civici = chunk["CIVICO"] if "CIVICO" in chunk.columns else [None] * len(chunk)
+            for comune, street, civico, lat, lon in zip(chunk["COMUNE"], chunk["VIA"], civici, chunk["LAT"], chunk["LON"]):
+                try:
+                    lat, lon = float(lat), float(lon)
+                except (TypeError, ValueError):
+                    continue
+                if pd.isna(comune) or pd.isna(street) or lat != lat or lon != lon:
+                    continue
+                rows.append((normalize_name(comune), normalize_name(street), parse_house_number(civico), lat, lon))
+        logger.info("Stradario: %d punti da %s", len(rows), path)
+        return cls(rows)
+
+    @classmethod
+    def load(cls, path):
+        """Carica uno stradario importato (.sqlite3) oppure lo importa da un CSV."""
+        if path.lower().endswith(".csv"):
+            return cls.from_csv(path)
+        with sqlite3.connect(path) as conn:
+            return cls(conn.execute("SELECT comune, via, civico, lat, lon FROM punti"))
+
+    def save(self, path):
+        if os.path.exists(path):
+            os.remove(path)
+        with sqlite3.connect(path) as conn:
+            conn.execute("CREATE TABLE punti (comune TEXT, via TEXT, civico INTEGER, lat REAL, lon REAL)")
+            conn.executemany(
+                "INSERT INTO punti VALUES (?, ?, ?, ?, ?)",
+                (
+                    (comune, street, number, lat, lon)
+                    for comune, streets in self.streets.items()
+                    for street, entry in streets.items()
+                    for number, (lat, lon) in [(None, entry.centroid), *zip(entry.numbers, entry.coords)]
+                ),
+            )
+
+    @property
+    def point_count(self):
+        return sum(len(entry.numbers) + 1 for streets in self.streets.values() for entry in streets.values())
+
+    def _find_street(self, comune, street):
+        streets = self.streets[comune]
+        if street in streets:
+            return streets[street]
+
+        # Stessa via con tipo mancante o diverso ("roma" oppure "piazza roma" per "via roma")
+        candidates = self.cores[comune].get(street_core(street), [])
+        if len(candidates) == 1:
+            return streets[candidates[0]]
+
+        return self._fuzzy_street(comune, street_core(street))
+
+    def _fuzzy_street(self, comune, core):
+        # Via con nome simile, confrontando solo i nomi senza tipo di strada ("roma", non "via roma"),
+        # accettata solo se nettamente più simile di tutte le altre
+        matcher = difflib.SequenceMatcher(b=core)
+        scores = []
+        for candidate in self.cores[comune]:
+            matcher.set_seq1(candidate)
+            if matcher.real_quick_ratio() >= FUZZY_CUTOFF and matcher.quick_ratio() >= FUZZY_CUTOFF:
+                scores.append((matcher.ratio(), candidate))
+        scores.sort(reverse=True)
+        if not scores or scores[0][0] < FUZZY_CUTOFF:
+            return None
+        if len(scores) > 1 and scores[0][0] - scores[1][0] < FUZZY_MARGIN:
+            logger.debug("Via %r ambigua nello stradario (%r, %r)", core, scores[0][1], scores[1][1])
+            return None
+        candidates = self.cores[comune][scores[0][1]]
+        if len(candidates) != 1:
+            return None
+        return self.streets[comune][candidates[0]]
+
+    def lookup(self, address):
+        """Coordinate (lat, lon) di un indirizzo oppure None se non è nello stradario."""
+        comune, street, number = split_address(address, self.comuni)
+        if comune is None or street is None:
+            return None
+        entry = self._find_street(comune, street)
+        return entry.locate(number) if entry is not None else None
+
+
+# Funzione per creare lo stradario configurato con TRAGITTO_GAZETTEER (None se non configurato)
+def get_gazetteer():
+    path = os.environ.get("TRAGITTO_GAZETTEER")
+    if not path:
+        return None
+    return Gazetteer.load(path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Importa uno stradario CSV per la geocodifica locale.")
+    parser.add_argument("input", help="CSV con le colonne COMUNE, VIA, CIVICO (facoltativa), LAT e LON")
+    parser.add_argument("-o", "--output", required=True, help="file dello stradario importato (.sqlite3)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+    gazetteer = Gazetteer.from_csv(args.input)
+    gazetteer.save(args.output)
+    print(f"Stradario salvato in {args.output}: {len(gazetteer.comuni)} comuni, {gazetteer.point_count} punti")
+
+
+if __name__ == "__main__":
+    main()
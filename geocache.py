@@ -0,0 +1,166 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+
+from shared import MemoryCache
+
+# Durata di validità delle voci in cache (in secondi)
+DEFAULT_TTL = 90 * 24 * 3600  # 90 giorni per gli indirizzi trovati
+DEFAULT_NEGATIVE_TTL = 24 * 3600  # 1 giorno per gli indirizzi non trovati
+DEFAULT_MAX_ENTRIES = 50000
+DEFAULT_MEMORY_ENTRIES = 20000  # Voci più usate tenute anche in memoria
+ACCESS_BATCH = 500  # Accessi in memoria accumulati prima di aggiornarne l'ora su disco
+EVICT_INTERVAL = 1000  # Voci inserite tra un controllo del numero di voci e il successivo
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    "TRAGITTO_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache"),
+)
+
+
+# Funzione per normalizzare un indirizzo in una chiave di cache stabile
+def normalize_address(address):
+    text = unicodedata.normalize("NFKC", str(address)).casefold()
+    # Spazi uniformi attorno alla punteggiatura
+    text = re.sub(r"\s*([,;])\s*", r"\1 ", text)
+    text = re.sub(r"\s+", " ", text)
+    return text.strip(" ,;")
+
+
+class GeocodeCache:
+    """
+    Cache persistente su SQLite per i risultati della geocodifica.
+
+    Le voci sono indicizzate sull'indirizzo normalizzato. Anche i risultati
+    negativi (indirizzo non trovato) vengono memorizzati, con una scadenza
+    più breve. Oltre max_entries voci vengono eliminate quelle usate meno
+    di recente; il numero di voci è controllato ogni EVICT_INTERVAL
+    inserimenti, quindi può superare max_entries di altrettanto. Le ultime
+    memory_entries voci usate restano anche in memoria, condivise da tutti
+    i thread che usano la stessa istanza; l'ora di accesso delle voci lette
+    dalla memoria viene scritta su disco a blocchi di ACCESS_BATCH e
+    comunque prima di ogni eliminazione.
+    """
+
+    def __init__(self, path=None, ttl=DEFAULT_TTL, negative_ttl=DEFAULT_NEGATIVE_TTL,
+                 max_entries=DEFAULT_MAX_ENTRIES, memory_entries=DEFAULT_MEMORY_ENTRIES):
+        if path is None:
+            path = os.path.join(DEFAULT_CACHE_DIR, "geocode.sqlite3")
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self._memory = MemoryCache(memory_entries)
+        self._inserted = 0  # Voci inserite dall'ultimo controllo del numero di voci
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS geocode (
+                key TEXT PRIMARY KEY,
+                lat REAL,
+                lon REAL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS geocode_accessed ON geocode (accessed_at)")
+        self._conn.commit()
+
+    def lookup(self, address):
+        """
+        Cerca un indirizzo in cache.
+
+        Restituisce (trovato, coordinate): coordinate è (lat, lon) oppure None
+        se l'indirizzo è noto come non geocodificabile.
+        """
+        key = normalize_address(address)
+        found, coords = self._memory.get(key)
+        if found:
+            accesses = self._memory.take_accesses(ACCESS_BATCH)
+            if accesses:
+                with self._lock:
+                    self._write_accesses(accesses)
+                    self._conn.commit()
+            return True, coords
+
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT lat, lon, created_at FROM geocode WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return False, None
+
+            lat, lon, created_at = row
+            ttl = self.negative_ttl if lat is None else self.ttl
+            if now - created_at > ttl:
+                self._conn.execute("DELETE FROM geocode WHERE key = ?", (key,))
+                self._conn.commit()
+                return False, None
+
+            self._conn.execute("UPDATE geocode SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+
+        coords = (lat, lon) if lat is not None else None
+        self._memory.put(key, coords, created_at + ttl)
+        return True, coords
+
+    def store(self, address, coords):
+        """Memorizza il risultato della geocodifica (None per un risultato negativo)."""
+        key = normalize_address(address)
+        lat, lon = coords if coords is not None else (None, None)
+        now = time.time()
+        self._memory.put(key, (lat, lon) if lat is not None else None,
+                         now + (self.ttl if lat is not None else self.negative_ttl))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO geocode (key, lat, lon, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, lat, lon, now, now),
+            )
+            self._inserted += 1
+            if self._inserted >= EVICT_INTERVAL:
+                self._evict()
+            self._conn.commit()
+
+    def _write_accesses(self, accesses):
+        if accesses:
+            self._conn.executemany(
+                "UPDATE geocode SET accessed_at = MAX(accessed_at, ?) WHERE key = ?",
+                [(accessed_at, key) for key, accessed_at in accesses.items()],
+            )
+
+    def _evict(self):
+        # Le ore di accesso delle voci lette dalla memoria vanno scritte prima di scegliere le più vecchie
+        self._write_accesses(self._memory.take_accesses())
+        self._inserted = 0
+        count = self._conn.execute("SELECT COUNT(*) FROM geocode").fetchone()[0]
+        excess = count - self.max_entries
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM geocode WHERE key IN (SELECT key FROM geocode ORDER BY accessed_at LIMIT ?)",
+                (excess,),
+            )
+
+    def purge_expired(self):
+        """Elimina tutte le voci scadute."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM geocode WHERE (lat IS NOT NULL AND created_at < ?) OR (lat IS NULL AND created_at < ?)",
+                (now - self.ttl, now - self.negative_ttl),
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._write_accesses(self._memory.take_accesses())
+            self._conn.commit()
+            self._conn.close()
@@ -0,0 +1,96 @@
+from geocache import normalize_address
+from http_client import get_client
+from metrics import count
+from shared import get_flight
+
+
+def nominatim_search(address, client=None):
+    """
+    Geocodifica un indirizzo con OpenStreetMap Nominatim.
+
+    Restituisce (lat, lon) oppure None se l'indirizzo non viene trovato.
+    Gli errori di rete vengono propagati al chiamante.
+    """
+    client = client or get_client("nominatim")
+    params = {
+        "q": address,
+        "format": "json",
+        "limit": 1
+    }
+    data = client.get_json("/search", params=params)
+
+    if data and len(data) > 0:
+        return float(data[0]["lat"]), float(data[0]["lon"])
+    return None
+
+
+def geocode_many(addresses, cache=None, client=None, gazetteer=None):
+    """
+    Geocodifica una lista di indirizzi, consultando prima lo stradario
+    locale (se presente, vedi gazetteer) e la cache.
+
+    Gli indirizzi non in cache vengono richiesti in parallelo, nel rispetto
+    del limite di frequenza di Nominatim; quelli già richiesti in questo
+    momento da un altro thread (es. un'altra sessione) non vengono richiesti
+    di nuovo, ma se ne attende il risultato. Restituisce due dizionari:
+    {indirizzo: (lat, lon) oppure None} ed {indirizzo: eccezione} per gli
+    indirizzi la cui richiesta è fallita.
+    """
+    client = client or get_client("nominatim")
+    results = {}
+    to_fetch = []
+    for address in dict.fromkeys(addresses):
+        if gazetteer is not None:
+            coords = gazetteer.lookup(address)
+            count("gazetteer.hits" if coords is not None else "gazetteer.misses")
+            if coords is not None:
+                results[address] = coords
+                continue
+        if cache is not None:
+            found, coords = cache.lookup(address)
+            count("geocode_cache.hits" if found else "geocode_cache.misses")
+            if found:
+                results[address] = coords
+                continue
+        to_fetch.append(address)
+
+    flight = get_flight("geocode")
+    keys = {address: normalize_address(address) for address in to_fetch}
+    owned, waiting = flight.claim(keys.values())
+    owned_set = set(owned)
+    mine = [address for address in to_fetch if keys[address] in owned_set]
+    count("geocode.coalesced", len(to_fetch) - len(mine))
+
+    errors = {}
+    fetched = {}
+    try:
+        if cache is not None:
+            # Un altro thread può aver appena terminato la stessa richiesta: controlla di nuovo la cache
+            for address in list(mine):
+                found, coords = cache.lookup(address)
+                if found:
+                    results[address] = fetched[keys[address]] = coords
+                    mine.remove(address)
+        for address, result in zip(mine, client.map(lambda a: nominatim_search(a, client), mine)):
+            fetched[keys[address]] = result
+            if isinstance(result, Exception):
+                errors[address] = result
+                continue
+            results[address] = result
+            if cache is not None:
+                # Memorizza anche i risultati negativi per non ripetere la richiesta
+                cache.store(address, result)
+    finally:
+        flight.finish(owned, fetched)
+
+    # Indirizzi richiesti da altri thread: se ne attende il risultato
+    for address in to_fetch:
+        key = keys[address]
+        if key in owned_set:
+            continue
+        try:
+            results[address] = waiting[key].result()
+        except Exception as e:
+            errors[address] = e
+
+    return results, errors
@@ -0,0 +1,204 @@
+"""
+Geometria dei percorsi da disegnare sulla mappa: decodifica delle polyline
+OSRM, semplificazione Douglas-Peucker adatta al livello di zoom e cache
+persistente delle geometrie delle tratte.
+"""
+import math
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from geocache import DEFAULT_CACHE_DIR
+from legcache import COORD_PRECISION, quantize_coords
+
+DEFAULT_MAX_AGE = 30 * 24 * 3600  # Come le tratte: dopo 30 giorni la geometria va richiesta di nuovo
+
+# Livello di dettaglio con cui le geometrie vengono salvate in cache (zoom massimo della mappa)
+CACHE_ZOOM = 18
+
+# Scarto massimo ammesso tra geometria originale e semplificata, in pixel sullo schermo
+DEFAULT_TOLERANCE_PX = 1.5
+
+
+def encode_polyline(points, precision=5):
+    """Codifica [(lat, lon), ...] nel formato polyline di Google/OSRM."""
+    scale = 10 ** precision
+    chunks = []
+    prev_lat = prev_lon = 0
+    for lat, lon in points:
+        lat, lon = int(round(lat * scale)), int(round(lon * scale))
+        for delta in (lat - prev_lat, lon - prev_lon):
+            value = ~(delta << 1) if delta < 0 else delta << 1
+            while value >= 0x20:
+                chunks.append(chr((0x20 | (value & 0x1F)) + 63))
+                value >>= 5
+            chunks.append(chr(value + 63))
+        prev_lat, prev_lon = lat, lon
+    return "".join(chunks)
+
+
+def decode_polyline(text, precision=5):
+    """Decodifica una polyline in [(lat, lon), ...]."""
+    scale = 10 ** precision
+    points = []
+    values = []
+    result = shift = 0
+    for char in text:
+        byte = ord(char) - 63
+        result |= (byte & 0x1F) << shift
+        shift += 5
+        if byte < 0x20:
+            values.append(~(result >> 1) if result & 1 else result >> 1)
+            result = shift = 0
+    lat = lon = 0
+    for dlat, dlon in zip(values[0::2], values[1::2]):
+        lat += dlat
+        lon += dlon
+        points.append((lat / scale, lon / scale))
+    return points
+
+
+def douglas_peucker(points, tolerance):
+    """
+    Semplifica una linea [(lat, lon), ...] con l'algoritmo di
+    Douglas-Peucker: restano solo i punti che si discostano più di
+    tolerance (in gradi di latitudine) dalla linea semplificata.
+    """
+    pts = np.asarray(points, dtype=float).reshape(-1, 2)
+    n = len(pts)
+    if n <= 2 or tolerance <= 0:
+        return [tuple(p) for p in pts]
+
+    # Proiezione equirettangolare locale: la longitudine viene scalata sulla latitudine media
+    scale = math.cos(math.radians(float(pts[:, 0].mean())))
+    xy = np.column_stack((pts[:, 1] * scale, pts[:, 0]))
+
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        a, b = xy[start], xy[end]
+        inner = xy[start + 1:end]
+        dx, dy = b - a
+        length = math.hypot(dx, dy)
+        if length == 0:
+            distances = np.hypot(inner[:, 0] - a[0], inner[:, 1] - a[1])
+        else:
+            distances = np.abs(dx * (inner[:, 1] - a[1]) - dy * (inner[:, 0] - a[0])) / length
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            split = start + 1 + farthest
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+    return [tuple(p) for p in pts[keep]]
+
+
+# Funzione per convertire uno scarto in pixel in gradi di latitudine a un certo zoom (tasselli da 256 px)
+def tolerance_for_zoom(zoom, latitude=0.0, pixels=DEFAULT_TOLERANCE_PX):
+    return pixels * 1.40625 * math.cos(math.radians(latitude)) / 2 ** zoom
+
+
+# Funzione per scegliere lo zoom con cui tutti i punti entrano in una mappa width x height pixel
+def zoom_for_bounds(points, width=700, height=450, max_zoom=CACHE_ZOOM):
+    pts = np.asarray(points, dtype=float).reshape(-1, 2)
+    lat_span = max(float(np.ptp(pts[:, 0])), 1e-6)
+    lon_span = max(float(np.ptp(pts[:, 1])), 1e-6)
+    lat_scale = math.cos(math.radians(float(pts[:, 0].mean())))
+    zoom = min(
+        math.log2(width * 360 / (256 * lon_span)),
+        math.log2(height * 360 * lat_scale / (256 * lat_span)),
+    )
+    return int(max(1, min(max_zoom, math.floor(zoom))))
+
+
+def simplify_for_zoom(points, zoom, pixels=DEFAULT_TOLERANCE_PX):
+    """Semplifica una linea con lo scarto di pixels pixel allo zoom indicato."""
+    if len(points) <= 2:
+        return list(points)
+    latitude = float(np.mean([p[0] for p in points]))
+    return douglas_peucker(points, tolerance_for_zoom(zoom, latitude, pixels))
+
+
+class GeometryCache:
+    """
+    Cache persistente su SQLite delle geometrie delle tratte, salvate come
+    polyline già semplificate al dettaglio massimo della mappa (CACHE_ZOOM).
+    """
+
+    def __init__(self, path=None, max_age=DEFAULT_MAX_AGE, precision=COORD_PRECISION):
+        if path is None:
+            path = os.path.join(DEFAULT_CACHE_DIR, "geometry.sqlite3")
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.max_age = max_age
+        self.precision = precision
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS geometry (
+                from_lat INTEGER NOT NULL,
+                from_lon INTEGER NOT NULL,
+                to_lat INTEGER NOT NULL,
+                to_lon INTEGER NOT NULL,
+                polyline TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (from_lat, from_lon, to_lat, to_lon)
+            )
+            """
+        )
+        self._conn.commit()
+
+    def _key(self, start_coords, end_coords):
+        return quantize_coords(start_coords, self.precision) + quantize_coords(end_coords, self.precision)
+
+    def get_many(self, pairs):
+        """Restituisce {posizione nella lista: [(lat, lon), ...]} per le tratte in cache."""
+        found = {}
+        min_created = time.time() - self.max_age
+        with self._lock:
+            for pos, (start_coords, end_coords) in enumerate(pairs):
+                row = self._conn.execute(
+                    "SELECT polyline FROM geometry WHERE from_lat = ? AND from_lon = ? AND to_lat = ? AND to_lon = ? "
+                    "AND created_at >= ?",
+                    self._key(start_coords, end_coords) + (min_created,),
+                ).fetchone()
+                if row is not None:
+                    found[pos] = decode_polyline(row[0])
+        return found
+
+    def store_many(self, geometries):
+        """Memorizza una lista di geometrie [(origine, destinazione, [(lat, lon), ...]), ...]."""
+        now = time.time()
+        rows = [
+            self._key(start_coords, end_coords) + (encode_polyline(simplify_for_zoom(points, CACHE_ZOOM)), now)
+            for start_coords, end_coords, points in geometries
+        ]
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO geometry (from_lat, from_lon, to_lat, to_lon, polyline, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._conn.commit()
+
+    def purge_expired(self):
+        """Elimina tutte le geometrie scadute."""
+        with self._lock:
+            self._conn.execute("DELETE FROM geometry WHERE created_at < ?", (time.time() - self.max_age,))
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
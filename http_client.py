@@ -0,0 +1,189 @@
+import contextvars
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import count, stage
+
+USER_AGENT = "TragittoCalculator/1.0"  # Necessario per le regole di Nominatim
+
+# Timeout (connessione, lettura) in secondi
+DEFAULT_TIMEOUT = (
+    float(os.environ.get("TRAGITTO_CONNECT_TIMEOUT", 5)),
+    float(os.environ.get("TRAGITTO_READ_TIMEOUT", 30)),
+)
+
+# Tentativi ripetuti per gli errori temporanei (rete, 429 e 5xx), con attesa esponenziale
+DEFAULT_MAX_RETRIES = int(os.environ.get("TRAGITTO_MAX_RETRIES", 3))
+DEFAULT_BACKOFF = float(os.environ.get("TRAGITTO_BACKOFF", 0.5))  # Attesa prima del primo nuovo tentativo (s)
+MAX_BACKOFF = 30.0
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Configurazione dei servizi esterni, sovrascrivibile con variabili d'ambiente
+SERVICES = {
+    "nominatim": {
+        "base_url": os.environ.get("TRAGITTO_NOMINATIM_URL", "https://nominatim.openstreetmap.org"),
+        # Policy di Nominatim: al massimo 1 richiesta al secondo
+        "rate": float(os.environ.get("TRAGITTO_NOMINATIM_RATE", 1.0)),
+        "max_concurrency": int(os.environ.get("TRAGITTO_NOMINATIM_CONCURRENCY", 2)),
+    },
+    "osrm": {
+        "base_url": os.environ.get("TRAGITTO_OSRM_URL", "http://router.project-osrm.org"),
+        # Nessun limite di frequenza di default: il nostro OSRM regge molte richieste parallele
+        "rate": float(os.environ.get("TRAGITTO_OSRM_RATE", 0)) or None,
+        "max_concurrency": int(os.environ.get("TRAGITTO_OSRM_CONCURRENCY", 16)),
+    },
+}
+
+
+class RateLimiter:
+    """Limitatore token bucket thread-safe: al massimo `rate` richieste al secondo."""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class ServiceClient:
+    """
+    Client HTTP per un singolo servizio esterno.
+
+    Usa una requests.Session con connessioni keep-alive, limita la frequenza
+    delle richieste con un RateLimiter e il numero di richieste contemporanee
+    con un pool di thread dedicato. Gli errori temporanei (rete, 429 e 5xx)
+    vengono ritentati fino a max_retries volte con attesa esponenziale,
+    rispettando l'intestazione Retry-After del server.
+    """
+
+    def __init__(self, name, base_url, rate=None, burst=1, max_concurrency=8, timeout=DEFAULT_TIMEOUT,
+                 max_retries=DEFAULT_MAX_RETRIES, backoff=DEFAULT_BACKOFF):
+        self.name = name
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.limiter = RateLimiter(rate, burst) if rate else None
+
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = USER_AGENT
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix=f"http-{name}")
+
+    def get(self, path, params=None, timeout=None):
+        """
+        Esegue una richiesta GET, ritentando gli errori temporanei. Restituisce
+        l'ultima risposta ricevuta (anche se di errore) oppure solleva
+        l'ultima eccezione di rete.
+        """
+        attempt = 0
+        while True:
+            try:
+                response = self._get_once(path, params, timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt >= self.max_retries:
+                    raise
+                delay = self._backoff_delay(attempt)
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt >= self.max_retries:
+                    return response
+                delay = self._backoff_delay(attempt, response.headers.get("Retry-After"))
+            attempt += 1
+            count(f"http.{self.name}.retries")
+            with stage(f"http.{self.name}.backoff"):
+                time.sleep(delay)
+
+    def _get_once(self, path, params, timeout):
+        if self.limiter is not None:
+            # Attesa imposta dal limite di frequenza, misurata a parte dalla richiesta
+            with stage(f"http.{self.name}.throttle"):
+                self.limiter.acquire()
+        count(f"http.{self.name}.requests")
+        try:
+            with stage(f"http.{self.name}"):
+                response = self.session.get(f"{self.base_url}{path}", params=params, timeout=timeout or self.timeout)
+        except requests.RequestException:
+            count(f"http.{self.name}.errors")
+            raise
+        count(f"http.{self.name}.bytes", len(response.content))
+        if response.status_code >= 400:
+            count(f"http.{self.name}.errors")
+        return response
+
+    def _backoff_delay(self, attempt, retry_after=None):
+        # Attesa indicata dal server (Retry-After in secondi), altrimenti esponenziale con jitter
+        if retry_after is not None:
+            try:
+                return min(MAX_BACKOFF, max(0.0, float(retry_after)))
+            except ValueError:
+                pass
+        return min(MAX_BACKOFF, self.backoff * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+    def get_json(self, path, params=None, timeout=None):
+        """Come get, ma solleva requests.HTTPError per le risposte di errore e restituisce il JSON."""
+        response = self.get(path, params=params, timeout=timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def submit(self, fn, *args, **kwargs):
+        # Il thread del pool esegue fn nel contesto del chiamante (es. la raccolta di metriche attiva)
+        return self._executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+    def map(self, fn, items):
+        """
+        Esegue fn su ogni elemento in parallelo e restituisce i risultati nello
+        stesso ordine. Le eccezioni vengono restituite al posto del risultato.
+        """
+        futures = [self.submit(fn, item) for item in items]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append(e)
+        return results
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+# Funzione per ottenere il client condiviso di un servizio
+def get_client(name):
+    with _clients_lock:
+        client = _clients.get(name)
+        if client is None:
+            client = ServiceClient(name, **SERVICES[name])
+            _clients[name] = client
+        return client
+
+
+# Funzione per riconfigurare un servizio (es. URL di un server OSRM locale)
+def configure_client(name, **options):
+    with _clients_lock:
+        SERVICES[name] = {**SERVICES[name], **options}
+        _clients.pop(name, None)
@@ -0,0 +1,168 @@
+"""
+Lettura dei file di input (CSV, Parquet, Excel) con le colonne CASA, LAVORO
+e GIORNO.
+
+I CSV vengono letti in una sola passata a blocchi, con il separatore
+riconosciuto dall'intestazione. Gli indirizzi vengono tenuti come categorie
+(ogni indirizzo distinto è memorizzato una volta sola) e GIORNO come data,
+così anche storici di anni con centinaia di migliaia di righe occupano poca
+memoria.
+"""
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from engine import REQUIRED_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNKSIZE = 50000
+
+# Formato delle date nei file (GG/MM/AAAA); sono accettate anche date ISO e altri formati con il giorno prima del mese
+DATE_FORMAT = "%d/%m/%Y"
+
+
+# Funzione per riconoscere il separatore dalla riga di intestazione
+def sniff_separator(header):
+    return ";" if header.count(";") >= header.count(",") else ","
+
+
+# Funzione per stabilire il formato di un file dall'estensione del nome
+def file_format(name):
+    extension = os.path.splitext(str(name or ""))[1].lower()
+    if extension == ".parquet":
+        return "parquet"
+    if extension in (".xlsx", ".xls"):
+        return "excel"
+    return "csv"
+
+
+def read_header(source):
+    # Prima riga del file, senza spostare la posizione di lettura di un file già aperto
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, encoding="utf-8-sig") as f:
+            return f.readline()
+    position = source.tell()
+    header = source.readline()
+    source.seek(position)
+    if isinstance(header, bytes):
+        header = header.decode("utf-8-sig", errors="replace")
+    return header
+
+
+def parse_days(series):
+    """
+    Converte la colonna GIORNO in date. Le stringhe vengono interpretate una
+    sola volta per valore distinto; i valori che non sono date restano
+    testuali (la colonna diventa mista). L'esito dipende solo dal valore,
+    quindi lo stesso giorno ha la stessa forma in tutti i blocchi del file.
+    """
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series.dt.normalize()
+
+    values = series.astype("category")
+    categories = values.cat.categories.astype(str)
+    if not len(categories):
+        return pd.Series(pd.NaT, index=series.index, dtype="datetime64[ns]", name=series.name)
+
+    parsed = pd.to_datetime(categories, format=DATE_FORMAT, errors="coerce")
+    for fallback in ({"format": "ISO8601"}, {"dayfirst": True}):
+        if not parsed.isna().any():
+            break
+        parsed = pd.DatetimeIndex([
+            day if not pd.isna(day) else pd.to_datetime(value, errors="coerce", **fallback)
+            for value, day in zip(categories, parsed)
+        ])
+
+    codes = values.cat.codes.to_numpy()
+    if parsed.isna().any():
+        logger.warning("Valori di GIORNO non riconosciuti come date (es. %r): restano testuali",
+                       categories[parsed.isna()][0])
+        days = np.array([value if pd.isna(day) else day for value, day in zip(categories, parsed)] + [np.nan],
+                        dtype=object)
+        return pd.Series(days[codes], index=series.index, name=series.name)
+
+    days = parsed.to_numpy()[codes]
+    days[codes == -1] = np.datetime64("NaT")
+    return pd.Series(days, index=series.index, name=series.name)
+
+
+def normalize_chunk(chunk):
+    """Tiene solo le colonne richieste, con indirizzi come categorie e GIORNO come data."""
+    # Pulisci gli spazi bianchi nelle intestazioni
+    chunk.columns = chunk.columns.astype(str).str.strip()
+    missing = [col for col in REQUIRED_COLUMNS if col not in chunk.columns]
+    if missing:
+        raise ValueError(f"Colonne mancanti nel file: {', '.join(missing)}")
+
+    return pd.DataFrame({
+        "CASA": chunk["CASA"].astype("category"),
+        "LAVORO": chunk["LAVORO"].astype("category"),
+        "GIORNO": parse_days(chunk["GIORNO"]),
+    })
+
+
+def iter_chunks(source, name=None, sep=None, chunksize=DEFAULT_CHUNKSIZE):
+    """
+    Legge un file (percorso o file aperto) a blocchi di righe già
+    normalizzati (vedi normalize_chunk). Il formato viene dedotto dal nome.
+    """
+    if name is None:
+        name = source if isinstance(source, (str, os.PathLike)) else getattr(source, "name", None)
+    fmt = file_format(name)
+
+    if fmt == "parquet":
+        try:
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise RuntimeError("Per leggere file Parquet è necessario installare pyarrow") from e
+        parquet = pq.ParquetFile(source)
+        columns = [col for col in parquet.schema_arrow.names if col.strip() in REQUIRED_COLUMNS]
+        for batch in parquet.iter_batches(batch_size=chunksize, columns=columns):
+            yield normalize_chunk(batch.to_pandas())
+        return
+
+    if fmt == "excel":
+        # Excel non si può leggere a blocchi: il foglio viene letto per intero
+        yield normalize_chunk(pd.read_excel(source, usecols=lambda col: str(col).strip() in REQUIRED_COLUMNS))
+        return
+
+    sep = sep or sniff_separator(read_header(source))
+    reader = pd.read_csv(source, sep=sep, chunksize=chunksize, encoding="utf-8-sig", dtype=str,
+                         usecols=lambda col: col.strip() in REQUIRED_COLUMNS)
+    for chunk in reader:
+        yield normalize_chunk(chunk)
+
+
+def _concat_chunks(chunks):
+    # Unisce i blocchi mantenendo le categorie (pd.concat le trasformerebbe in testo)
+    if len(chunks) == 1:
+        return chunks[0].reset_index(drop=True)
+    columns = {}
+    for col in REQUIRED_COLUMNS:
+        parts = [chunk[col] for chunk in chunks]
+        if all(isinstance(part.dtype, pd.CategoricalDtype) for part in parts):
+            columns[col] = pd.Series(union_categoricals(parts, ignore_order=True), name=col)
+        else:
+            columns[col] = pd.concat(parts, ignore_index=True)
+    return pd.DataFrame(columns)
+
+
+def read_table(source, name=None, sep=None, chunksize=DEFAULT_CHUNKSIZE):
+    """Legge un intero file di input in un DataFrame normalizzato."""
+    chunks = list(iter_chunks(source, name, sep, chunksize))
+    if not chunks:
+        return normalize_chunk(pd.DataFrame(columns=REQUIRED_COLUMNS))
+    return _concat_chunks(chunks)
+
+
+def build_day_index(df):
+    """
+    Indice dei giorni: {giorno: posizioni delle sue righe}, nell'ordine di
+    prima apparizione, per estrarre un giorno senza scorrere tutto il file.
+    """
+    groups = df.groupby("GIORNO", sort=False, observed=True).indices
+    return dict(sorted(groups.items(), key=lambda item: item[1][0]))
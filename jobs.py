@@ -0,0 +1,227 @@
+"""
+Calcolo in background dei percorsi di molti giorni (riepilogo totale).
+
+Il calcolo gira in un thread e procede a blocchi di giorni, che condividono
+geocodifica e tratte: ogni giorno, appena calcolato, viene salvato in un
+archivio persistente (CheckpointStore) e reso visibile a chi segue
+l'avanzamento. Un calcolo interrotto (rerun, chiusura del browser, riavvio del
+processo) riparte dai giorni mancanti.
+"""
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+from engine import is_complete
+from geocache import DEFAULT_CACHE_DIR
+from metrics import Metrics, collect, count, log_metrics
+
+logger = logging.getLogger(__name__)
+
+# Giorni calcolati insieme (geocodifica e tratte condivise)
+DEFAULT_JOB_BATCH_DAYS = 25
+
+DEFAULT_CHECKPOINT_MAX_AGE = 30 * 24 * 3600  # Come le tratte in cache: poi il giorno va ricalcolato
+
+# Calcoli terminati tenuti in memoria per chi si ricollega (es. dopo un refresh del browser)
+MAX_FINISHED_JOBS = 8
+
+RUNNING = "in_corso"
+COMPLETED = "completato"
+CANCELLED = "interrotto"
+FAILED = "errore"
+
+
+class CheckpointStore:
+    """
+    Archivio persistente su SQLite dei risultati dei singoli giorni,
+    indicizzati sull'impronta del giorno (vedi engine.day_fingerprint).
+    """
+
+    def __init__(self, path=None, max_age=DEFAULT_CHECKPOINT_MAX_AGE):
+        if path is None:
+            path = os.path.join(DEFAULT_CACHE_DIR, "checkpoints.sqlite3")
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                data BLOB NOT NULL,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+
+    def get_many(self, keys):
+        """Restituisce {chiave: risultato} per le chiavi salvate e non scadute."""
+        found = {}
+        min_created = time.time() - self.max_age
+        with self._lock:
+            for key in keys:
+                row = self._conn.execute(
+                    "SELECT data FROM results WHERE key = ? AND created_at >= ?", (key, min_created)
+                ).fetchone()
+                if row is not None:
+                    found[key] = pickle.loads(row[0])
+        return found
+
+    def store_many(self, results):
+        """Salva i risultati {chiave: risultato}."""
+        now = time.time()
+        rows = [(key, pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL), now) for key, result in results.items()]
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO results (key, data, created_at) VALUES (?, ?, ?)", rows)
+            self._conn.commit()
+
+    def purge_expired(self):
+        """Elimina tutti i risultati scaduti."""
+        with self._lock:
+            self._conn.execute("DELETE FROM results WHERE created_at < ?", (time.time() - self.max_age,))
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class SummaryJob:
+    """
+    Calcolo in background dei giorni [(giorno, righe del giorno, chiave)].
+
+    I giorni con la stessa chiave vengono calcolati una volta sola; quelli
+    già in known o nel CheckpointStore non vengono ricalcolati. I giorni con
+    tratte stimate per un errore del router non vengono salvati, così un
+    nuovo calcolo richiede solo le tratte mancanti. progress() restituisce
+    in ogni momento lo stato e i risultati disponibili.
+    """
+
+    def __init__(self, engine, days, objective="distance", mode="exact", store=None, known=None,
+                 batch_days=DEFAULT_JOB_BATCH_DAYS):
+        self.engine = engine
+        self.objective = objective
+        self.mode = mode
+        self.store = store
+        self.batch_days = batch_days
+        self.metrics = Metrics()
+        self.performance = None
+
+        self._days = {}
+        for giorno, day_df, key in days:
+            self._days.setdefault(key, (giorno, day_df))
+        self._results = {key: result for key, result in (known or {}).items() if key in self._days}
+        self._errors = {}
+        self._status = RUNNING
+        self._lock = threading.Lock()
+        self._cancel = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="riepilogo", daemon=True)
+        self.started_at = time.time()
+        self.finished_at = None
+
+    @property
+    def total(self):
+        return len(self._days)
+
+    @property
+    def running(self):
+        return self._thread.is_alive() or self._status == RUNNING
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def cancel(self):
+        """Chiede l'interruzione del calcolo al termine del giorno in corso."""
+        self._cancel.set()
+
+    def wait(self, timeout=None):
+        self._thread.join(timeout)
+
+    def progress(self):
+        """Stato del calcolo: {status, done, total, results, errors}."""
+        with self._lock:
+            return {
+                "status": self._status,
+                "done": len(self._results) + len(self._errors),
+                "total": self.total,
+                "results": dict(self._results),
+                "errors": dict(self._errors),
+            }
+
+    def _run(self):
+        status = FAILED
+        with collect(self.metrics):
+            try:
+                pending = [key for key in self._days if key not in self._results]
+                if self.store is not None and pending:
+                    restored = self.store.get_many(pending)
+                    count("checkpoint.hits", len(restored))
+                    with self._lock:
+                        self._results.update(restored)
+                    pending = [key for key in pending if key not in restored]
+
+                for start in range(0, len(pending), self.batch_days):
+                    batch = pending[start:start + self.batch_days]
+                    planned = self.engine.plan_days([self._days[key] for key in batch], self.objective, self.mode)
+                    for key, (_, result, error) in zip(batch, planned):
+                        self._publish(key, result, error)
+                        if self._cancel.is_set():
+                            break
+                    planned.close()
+                    if self._cancel.is_set():
+                        status = CANCELLED
+                        break
+                else:
+                    status = COMPLETED
+            except Exception:
+                logger.exception("Errore durante il calcolo del riepilogo")
+        self.finished_at = time.time()
+        self.performance = log_metrics("riepilogo_totale", self.metrics, giorni=self.total,
+                                       mode=self.mode, status=status)
+        with self._lock:
+            self._status = status
+
+    def _publish(self, key, result, error):
+        # Rende visibile il giorno appena calcolato e, se definitivo, lo salva subito
+        with self._lock:
+            if error is not None:
+                self._errors[key] = str(error)
+            else:
+                self._results[key] = result
+        if error is None and self.store is not None and is_complete(result):
+            self.store.store_many({key: result})
+
+
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+
+# Funzione per ottenere il calcolo associato a una chiave (es. impronta del file), se esiste
+def get_job(key):
+    with _jobs_lock:
+        return _jobs.get(key)
+
+
+# Funzione per avviare (o ritrovare, se ancora in corso) il calcolo associato a una chiave
+def start_job(key, engine, days, objective="distance", mode="exact", store=None, known=None):
+    with _jobs_lock:
+        job = _jobs.get(key)
+        if job is not None and job.running:
+            return job
+        job = SummaryJob(engine, days, objective, mode, store=store, known=known).start()
+        _jobs[key] = job
+
+        finished = sorted((j.started_at, k) for k, j in _jobs.items() if not j.running)
+        for _, old_key in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del _jobs[old_key]
+        return job
@@ -0,0 +1,174 @@
+import os
+import sqlite3
+import threading
+import time
+
+from geocache import ACCESS_BATCH, DEFAULT_CACHE_DIR, EVICT_INTERVAL
+from shared import MemoryCache
+
+# Precisione delle coordinate usate come chiave (5 decimali ≈ 1 metro)
+COORD_PRECISION = 5
+
+DEFAULT_MAX_AGE = 30 * 24 * 3600  # Dopo 30 giorni una tratta va ricalcolata
+DEFAULT_MAX_ENTRIES = 500000
+DEFAULT_MEMORY_ENTRIES = 100000  # Tratte più usate tenute anche in memoria
+
+
+# Funzione per quantizzare una coppia (lat, lon) in interi confrontabili
+def quantize_coords(coords, precision=COORD_PRECISION):
+    scale = 10 ** precision
+    return int(round(coords[0] * scale)), int(round(coords[1] * scale))
+
+
+class LegCache:
+    """
+    Cache persistente su SQLite delle tratte origine → destinazione.
+
+    Ogni voce contiene distanza (km) e durata (minuti) ed è indicizzata
+    sulle coordinate quantizzate di origine e destinazione. Le tratte più
+    vecchie di max_age sono considerate scadute; oltre max_entries voci
+    vengono eliminate quelle usate meno di recente. Il numero di voci è
+    controllato ogni EVICT_INTERVAL inserimenti, quindi può superare
+    max_entries di altrettanto. Le ultime memory_entries tratte usate
+    restano anche in memoria, condivise da tutti i thread che usano la
+    stessa istanza; l'ora di accesso delle tratte lette dalla memoria viene
+    scritta su disco a blocchi di ACCESS_BATCH e comunque prima di ogni
+    eliminazione.
+    """
+
+    def __init__(self, path=None, max_age=DEFAULT_MAX_AGE, max_entries=DEFAULT_MAX_ENTRIES,
+                 precision=COORD_PRECISION, memory_entries=DEFAULT_MEMORY_ENTRIES):
+        if path is None:
+            path = os.path.join(DEFAULT_CACHE_DIR, "legs.sqlite3")
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.max_age = max_age
+        self.max_entries = max_entries
+        self.precision = precision
+        self._memory = MemoryCache(memory_entries)
+        self._inserted = 0  # Voci inserite dall'ultimo controllo del numero di voci
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS legs (
+                from_lat INTEGER NOT NULL,
+                from_lon INTEGER NOT NULL,
+                to_lat INTEGER NOT NULL,
+                to_lon INTEGER NOT NULL,
+                distance REAL NOT NULL,
+                duration REAL NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                PRIMARY KEY (from_lat, from_lon, to_lat, to_lon)
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS legs_accessed ON legs (accessed_at)")
+        self._conn.commit()
+
+    def _key(self, start_coords, end_coords):
+        return quantize_coords(start_coords, self.precision) + quantize_coords(end_coords, self.precision)
+
+    def get_many(self, pairs):
+        """
+        Cerca in cache una lista di tratte [(origine, destinazione), ...].
+
+        Restituisce un dizionario {posizione nella lista: (distanza, durata)}
+        con le sole tratte trovate e non scadute.
+        """
+        now = time.time()
+        found = {}
+        hit_keys = []
+        to_read = []
+        for pos, (start_coords, end_coords) in enumerate(pairs):
+            key = self._key(start_coords, end_coords)
+            in_memory, leg = self._memory.get(key)
+            if in_memory:
+                found[pos] = leg
+            else:
+                to_read.append((pos, key))
+        accesses = self._memory.take_accesses(ACCESS_BATCH)
+        if not to_read and not accesses:
+            return found
+
+        with self._lock:
+            self._write_accesses(accesses)
+            for pos, key in to_read:
+                row = self._conn.execute(
+                    "SELECT distance, duration, created_at FROM legs "
+                    "WHERE from_lat = ? AND from_lon = ? AND to_lat = ? AND to_lon = ?",
+                    key,
+                ).fetchone()
+                if row is None or now - row[2] > self.max_age:
+                    continue
+                found[pos] = (row[0], row[1])
+                hit_keys.append((now,) + key)
+                self._memory.put(key, found[pos], row[2] + self.max_age)
+
+            if hit_keys:
+                self._conn.executemany(
+                    "UPDATE legs SET accessed_at = ? "
+                    "WHERE from_lat = ? AND from_lon = ? AND to_lat = ? AND to_lon = ?",
+                    hit_keys,
+                )
+            if hit_keys or accesses:
+                self._conn.commit()
+        return found
+
+    def store_many(self, legs):
+        """Memorizza una lista di tratte [(origine, destinazione, distanza, durata), ...]."""
+        now = time.time()
+        rows = [
+            self._key(start_coords, end_coords) + (float(distance), float(duration), now, now)
+            for start_coords, end_coords, distance, duration in legs
+        ]
+        if not rows:
+            return
+        for row in rows:
+            self._memory.put(row[:4], (row[4], row[5]), now + self.max_age)
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO legs "
+                "(from_lat, from_lon, to_lat, to_lon, distance, duration, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._inserted += len(rows)
+            if self._inserted >= EVICT_INTERVAL:
+                self._evict()
+            self._conn.commit()
+
+    def _write_accesses(self, accesses):
+        if accesses:
+            self._conn.executemany(
+                "UPDATE legs SET accessed_at = MAX(accessed_at, ?) "
+                "WHERE from_lat = ? AND from_lon = ? AND to_lat = ? AND to_lon = ?",
+                [(accessed_at,) + key for key, accessed_at in accesses.items()],
+            )
+
+    def _evict(self):
+        # Le ore di accesso delle voci lette dalla memoria vanno scritte prima di scegliere le più vecchie
+        self._write_accesses(self._memory.take_accesses())
+        self._inserted = 0
+        count = self._conn.execute("SELECT COUNT(*) FROM legs").fetchone()[0]
+        excess = count - self.max_entries
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM legs WHERE rowid IN (SELECT rowid FROM legs ORDER BY accessed_at LIMIT ?)",
+                (excess,),
+            )
+
+    def purge_expired(self):
+        """Elimina tutte le tratte scadute."""
+        with self._lock:
+            self._conn.execute("DELETE FROM legs WHERE created_at < ?", (time.time() - self.max_age,))
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._write_accesses(self._memory.take_accesses())
+            self._conn.commit()
+            self._conn.close()
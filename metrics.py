@@ -0,0 +1,119 @@
+"""
+Misure di prestazione della pipeline: tempo di ogni fase e contatori
+(richieste HTTP, byte ricevuti, hit/miss delle cache, errori).
+
+Le misure finiscono nel Metrics attivo nel contesto corrente (vedi collect):
+il codice della pipeline chiama stage() e count(), che non fanno nulla se
+nessuna raccolta è attiva. I thread dei client HTTP ereditano il contesto di
+chi ha inviato la richiesta, quindi ogni raccolta vede solo le proprie
+richieste anche con più sessioni Streamlit attive.
+"""
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+logger = logging.getLogger("tragitto.metrics")
+
+# File in cui aggiungere una riga JSON per ogni raccolta registrata (opzionale)
+METRICS_LOG = os.environ.get("TRAGITTO_METRICS_LOG")
+
+_current = contextvars.ContextVar("tragitto_metrics", default=None)
+_log_lock = threading.Lock()
+
+
+class Metrics:
+    """Tempi per fase e contatori di una raccolta, thread-safe."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages = {}
+        self.counters = {}
+
+    def add_time(self, name, seconds):
+        with self._lock:
+            entry = self.stages.setdefault(name, {"seconds": 0.0, "calls": 0, "max_seconds": 0.0})
+            entry["seconds"] += seconds
+            entry["calls"] += 1
+            entry["max_seconds"] = max(entry["max_seconds"], seconds)
+
+    def add(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "stages": {
+                    name: {key: round(value, 6) if isinstance(value, float) else value for key, value in entry.items()}
+                    for name, entry in self.stages.items()
+                },
+                "counters": dict(self.counters),
+            }
+
+
+@contextmanager
+def collect(metrics=None):
+    """Attiva una raccolta per il blocco di codice; restituisce il Metrics."""
+    metrics = metrics if metrics is not None else Metrics()
+    token = _current.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def stage(name):
+    """Misura la durata del blocco come una chiamata della fase name."""
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.add_time(name, time.perf_counter() - start)
+
+
+def count(name, n=1):
+    """Incrementa il contatore name della raccolta attiva."""
+    metrics = _current.get()
+    if metrics is not None and n:
+        metrics.add(name, n)
+
+
+def enable_stream_logging(level=logging.INFO):
+    """
+    Scrive le righe JSON del logger su stderr anche quando il processo non
+    configura il logging (es. dentro Streamlit, dove altrimenti andrebbero
+    perse). Chiamarla più volte non aggiunge altri handler.
+    """
+    if not any(getattr(handler, "_tragitto_metrics", False) for handler in logger.handlers):
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        handler._tragitto_metrics = True
+        logger.addHandler(handler)
+        logger.propagate = False
+    logger.setLevel(level)
+
+
+def log_metrics(event, metrics, **fields):
+    """Registra una raccolta come riga JSON sul logger e, se configurato, su METRICS_LOG."""
+    record = {
+        "event": event,
+        "time": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        **fields,
+        **metrics.snapshot(),
+    }
+    line = json.dumps(record, default=str, ensure_ascii=False)
+    logger.info(line)
+    if METRICS_LOG:
+        with _log_lock, open(METRICS_LOG, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+    return record
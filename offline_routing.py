@@ -0,0 +1,343 @@
+"""
+Calcolo delle tratte offline su un grafo stradale locale costruito da un
+estratto OpenStreetMap, senza server OSRM.
+
+Il grafo può essere letto direttamente da un file .osm (XML) o .pbf
+(richiede il pacchetto osmium), ma conviene prepararlo una volta sola:
+
+    python offline_routing.py lombardia.osm.pbf -o lombardia.npz
+
+e poi usarlo impostando TRAGITTO_ROUTING_GRAPH=lombardia.npz.
+"""
+import argparse
+import heapq
+import logging
+import math
+import re
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+from estimate import EARTH_RADIUS_KM, MAX_SPEED_KMH
+from routing import RoutingBackend
+
+logger = logging.getLogger(__name__)
+
+# Velocità di default (km/h) per tipo di strada, se manca maxspeed
+HIGHWAY_SPEEDS_KMH = {
+    "motorway": 120, "motorway_link": 60,
+    "trunk": 90, "trunk_link": 50,
+    "primary": 70, "primary_link": 40,
+    "secondary": 60, "secondary_link": 40,
+    "tertiary": 50, "tertiary_link": 30,
+    "unclassified": 40, "residential": 30, "living_street": 10,
+    "service": 20, "road": 30,
+}
+
+# Oltre questa distanza (km) dal nodo più vicino un punto è considerato fuori dal grafo
+MAX_SNAP_DISTANCE_KM = 5.0
+
+
+# Funzione per interpretare il tag maxspeed (es. "50", "50 km/h", "30 mph")
+def parse_maxspeed(value):
+    if not value:
+        return None
+    match = re.match(r"\s*(\d+(?:\.\d+)?)\s*(mph)?", value)
+    if not match:
+        return None
+    speed = float(match.group(1))
+    return speed * 1.609 if match.group(2) else speed
+
+
+# Funzione per stabilire i sensi di marcia di una strada: (avanti, indietro)
+def way_directions(tags):
+    oneway = tags.get("oneway", "")
+    if oneway in ("yes", "true", "1"):
+        return True, False
+    if oneway == "-1":
+        return False, True
+    if oneway == "no":
+        return True, True
+    if tags.get("highway") == "motorway" or tags.get("junction") in ("roundabout", "circular"):
+        return True, False
+    return True, True
+
+
+def _haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def _read_osm_xml(path):
+    # Restituisce {id nodo: (lat, lon)} e la lista delle strade [(nodi, tag)]
+    nodes = {}
+    ways = []
+    for _, elem in ET.iterparse(path, events=("end",)):
+        if elem.tag == "node":
+            nodes[int(elem.get("id"))] = (float(elem.get("lat")), float(elem.get("lon")))
+            elem.clear()
+        elif elem.tag == "way":
+            tags = {tag.get("k"): tag.get("v") for tag in elem.iter("tag")}
+            if tags.get("highway") in HIGHWAY_SPEEDS_KMH:
+                ways.append(([int(nd.get("ref")) for nd in elem.iter("nd")], tags))
+            elem.clear()
+    return nodes, ways
+
+
+def _read_osm_pbf(path):
+    try:
+        import osmium
+    except ImportError as e:
+        raise RuntimeError("Per leggere file .pbf è necessario installare osmium (pip install osmium)") from e
+
+    nodes = {}
+    ways = []
+
+    class Handler(osmium.SimpleHandler):
+        def way(self, w):
+            tags = {tag.k: tag.v for tag in w.tags}
+            if tags.get("highway") not in HIGHWAY_SPEEDS_KMH:
+                return
+            refs = []
+            for nd in w.nodes:
+                if nd.location.valid():
+                    nodes[nd.ref] = (nd.location.lat, nd.location.lon)
+                    refs.append(nd.ref)
+            ways.append((refs, tags))
+
+    Handler().apply_file(path, locations=True)
+    return nodes, ways
+
+
+class RoadGraph:
+    """
+    Grafo stradale orientato in formato CSR: per ogni nodo gli archi uscenti
+    con lunghezza (km) e tempo di percorrenza (minuti).
+    """
+
+    def __init__(self, lat, lon, indptr, indices, length_km, time_min):
+        self.lat = np.asarray(lat, dtype=float)
+        self.lon = np.asarray(lon, dtype=float)
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.length_km = np.asarray(length_km, dtype=float)
+        self.time_min = np.asarray(time_min, dtype=float)
+
+        # Velocità massima degli archi (km/h), per l'euristica di A*: anche per i grafi
+        # preparati con velocità oltre MAX_SPEED_KMH l'euristica non sovrastima i tempi
+        moving = self.time_min > 0
+        self.max_speed_kmh = (
+            max(float((self.length_km[moving] / self.time_min[moving]).max()) * 60, MAX_SPEED_KMH)
+            if moving.any() else MAX_SPEED_KMH
+        )
+
+        # Liste di adiacenza Python: molto più veloci degli slice NumPy dentro Dijkstra
+        self.adjacency = [
+            list(zip(self.indices[start:end].tolist(), self.time_min[start:end].tolist(),
+                     self.length_km[start:end].tolist()))
+            for start, end in zip(self.indptr[:-1], self.indptr[1:])
+        ]
+
+    @property
+    def node_count(self):
+        return len(self.lat)
+
+    @classmethod
+    def from_osm(cls, path):
+        """Costruisce il grafo da un estratto OSM (.osm XML oppure .pbf)."""
+        nodes, ways = _read_osm_pbf(path) if path.lower().endswith(".pbf") else _read_osm_xml(path)
+
+        index = {}
+        sources, targets, speeds = [], [], []
+        for refs, tags in ways:
+            refs = [ref for ref in refs if ref in nodes]
+            forward, backward = way_directions(tags)
+            # Velocità limitata a MAX_SPEED_KMH, su cui si basano le stime minime delle durate
+            speed = min(parse_maxspeed(tags.get("maxspeed")) or HIGHWAY_SPEEDS_KMH[tags["highway"]], MAX_SPEED_KMH)
+            for a, b in zip(refs[:-1], refs[1:]):
+                ia = index.setdefault(a, len(index))
+                ib = index.setdefault(b, len(index))
+                if forward:
+                    sources.append(ia)
+                    targets.append(ib)
+                    speeds.append(speed)
+                if backward:
+                    sources.append(ib)
+                    targets.append(ia)
+                    speeds.append(speed)
+
+        coords = np.array([nodes[ref] for ref in index], dtype=float).reshape(-1, 2)
+        sources = np.array(sources, dtype=np.int64)
+        targets = np.array(targets, dtype=np.int64)
+        length_km = _haversine_km(coords[sources, 0], coords[sources, 1], coords[targets, 0], coords[targets, 1])
+        time_min = length_km / np.array(speeds, dtype=float) * 60
+
+        order = np.argsort(sources, kind="stable")
+        indptr = np.concatenate(([0], np.cumsum(np.bincount(sources, minlength=len(coords)))))
+        logger.info("Grafo stradale: %d nodi, %d archi", len(coords), len(sources))
+        return cls(coords[:, 0], coords[:, 1], indptr, targets[order], length_km[order], time_min[order])
+
+    @classmethod
+    def load(cls, path):
+        """Carica un grafo preparato (.npz) oppure lo costruisce da un estratto OSM."""
+        if not path.lower().endswith(".npz"):
+            return cls.from_osm(path)
+        data = np.load(path)
+        return cls(data["lat"], data["lon"], data["indptr"], data["indices"], data["length_km"], data["time_min"])
+
+    def save(self, path):
+        np.savez_compressed(path, lat=self.lat, lon=self.lon, indptr=self.indptr, indices=self.indices,
+                            length_km=self.length_km, time_min=self.time_min)
+
+    def nearest_node(self, coords):
+        """Nodo più vicino a (lat, lon) e la sua distanza in km."""
+        distances = _haversine_km(coords[0], coords[1], self.lat, self.lon)
+        node = int(np.argmin(distances))
+        return node, float(distances[node])
+
+    def one_to_many(self, source, targets):
+        """
+        Dijkstra sul tempo di percorrenza da source, interrotto appena tutti i
+        targets sono raggiunti. Restituisce {target: (km, minuti)} per i
+        target raggiungibili.
+        """
+        remaining = set(targets)
+        found = {}
+        best = {source: 0.0}
+        heap = [(0.0, 0.0, source)]
+        adjacency = self.adjacency
+        while heap and remaining:
+            time_min, length_km, node = heapq.heappop(heap)
+            if time_min > best.get(node, math.inf):
+                continue
+            if node in remaining:
+                remaining.discard(node)
+                found[node] = (length_km, time_min)
+            for neighbour, edge_time, edge_length in adjacency[node]:
+                candidate = time_min + edge_time
+                if candidate < best.get(neighbour, math.inf):
+                    best[neighbour] = candidate
+                    heapq.heappush(heap, (candidate, length_km + edge_length, neighbour))
+        return found
+
+    def shortest_path(self, source, target, with_path=False):
+        """
+        A* sul tempo di percorrenza tra due nodi, con euristica linea d'aria
+        alla velocità massima degli archi del grafo. Restituisce (km, minuti) oppure None; con
+        with_path=True (km, minuti, lista dei nodi attraversati).
+        """
+        if source == target:
+            return (0.0, 0.0, [source]) if with_path else (0.0, 0.0)
+        target_lat, target_lon = self.lat[target], self.lon[target]
+        minutes_per_km = 60 / self.max_speed_kmh
+
+        def heuristic(node):
+            return float(_haversine_km(self.lat[node], self.lon[node], target_lat, target_lon)) * minutes_per_km
+
+        best = {source: 0.0}
+        parents = {}
+        heap = [(heuristic(source), 0.0, 0.0, source)]
+        adjacency = self.adjacency
+        while heap:
+            _, time_min, length_km, node = heapq.heappop(heap)
+            if node == target:
+                if not with_path:
+                    return length_km, time_min
+                path = [node]
+                while path[-1] != source:
+                    path.append(parents[path[-1]])
+                return length_km, time_min, path[::-1]
+            if time_min > best.get(node, math.inf):
+                continue
+            for neighbour, edge_time, edge_length in adjacency[node]:
+                candidate = time_min + edge_time
+                if candidate < best.get(neighbour, math.inf):
+                    best[neighbour] = candidate
+                    parents[neighbour] = node
+                    heapq.heappush(heap, (candidate + heuristic(neighbour), candidate, length_km + edge_length, neighbour))
+        return None
+
+
+class LocalGraphBackend(RoutingBackend):
+    """Motore di calcolo delle tratte che lavora in-process su un RoadGraph locale."""
+
+    name = "local"
+
+    def __init__(self, graph, max_snap_km=MAX_SNAP_DISTANCE_KM):
+        self.graph = RoadGraph.load(graph) if isinstance(graph, str) else graph
+        self.max_snap_km = max_snap_km
+        self._snapped = {}
+
+    def _snap(self, coords):
+        # Nodo del grafo corrispondente a un punto (None se troppo lontano dalla rete)
+        key = (round(coords[0], 6), round(coords[1], 6))
+        if key not in self._snapped:
+            node, distance = self.graph.nearest_node(coords)
+            self._snapped[key] = node if distance <= self.max_snap_km else None
+        return self._snapped[key]
+
+    def table_rows(self, coords_list, destinations_by_source):
+        nodes = [self._snap(coords) for coords in coords_list]
+        legs = {}
+        for i, destinations in destinations_by_source.items():
+            if nodes[i] is None:
+                continue
+            targets = {nodes[j] for j in destinations if nodes[j] is not None}
+            found = self.graph.one_to_many(nodes[i], targets)
+            for j in destinations:
+                if i == j:
+                    continue
+                if nodes[j] in found:
+                    legs[i, j] = found[nodes[j]]
+        return legs
+
+    def table(self, coords_list, sources=None, destinations=None):
+        n = len(coords_list)
+        sources = range(n) if sources is None else sorted(set(sources))
+        destinations = list(range(n)) if destinations is None else sorted(set(destinations))
+
+        distances = np.full((n, n), np.nan)
+        durations = np.full((n, n), np.nan)
+        legs = self.table_rows(coords_list, {i: destinations for i in sources})
+        for (i, j), (dist, dur) in legs.items():
+            distances[i, j] = dist
+            durations[i, j] = dur
+        np.fill_diagonal(distances, 0)
+        np.fill_diagonal(durations, 0)
+        return distances, durations
+
+    def route(self, start_coords, end_coords):
+        source, target = self._snap(start_coords), self._snap(end_coords)
+        if source is None or target is None:
+            raise ValueError("Punto troppo lontano dalla rete stradale locale")
+        result = self.graph.shortest_path(source, target)
+        if result is None:
+            raise ValueError("Nessun percorso sulla rete stradale locale")
+        return result
+
+    def route_geometry(self, start_coords, end_coords):
+        source, target = self._snap(start_coords), self._snap(end_coords)
+        if source is None or target is None:
+            raise ValueError("Punto troppo lontano dalla rete stradale locale")
+        result = self.graph.shortest_path(source, target, with_path=True)
+        if result is None:
+            raise ValueError("Nessun percorso sulla rete stradale locale")
+        path = result[2]
+        return [tuple(start_coords)] + [(float(self.graph.lat[node]), float(self.graph.lon[node])) for node in path] + [tuple(end_coords)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Prepara un grafo stradale locale da un estratto OpenStreetMap.")
+    parser.add_argument("input", help="estratto OSM (.osm oppure .pbf)")
+    parser.add_argument("-o", "--output", required=True, help="file del grafo preparato (.npz)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+    graph = RoadGraph.from_osm(args.input)
+    graph.save(args.output)
+    print(f"Grafo salvato in {args.output}: {graph.node_count} nodi, {len(graph.indices)} archi")
+
+
+if __name__ == "__main__":
+    main()
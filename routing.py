@@ -0,0 +1,303 @@
+import logging
+import os
+
+import numpy as np
+
+from geometry import decode_polyline
+from http_client import get_client
+
+logger = logging.getLogger(__name__)
+
+# Numero massimo di coordinate per singola richiesta /table
+# (il server pubblico OSRM accetta al massimo 100 coordinate)
+DEFAULT_TABLE_MAX_COORDS = 100
+
+
+def _format_coords(coords_list):
+    # OSRM vuole le coordinate nel formato lon,lat
+    return ";".join(f"{lon},{lat}" for lat, lon in coords_list)
+
+
+def fetch_route(start_coords, end_coords, client=None):
+    """
+    Calcola distanza (km) e durata (minuti) tra due punti con l'endpoint
+    /route di OSRM. Solleva un'eccezione se il percorso non è disponibile.
+    """
+    client = client or get_client("osrm")
+    # La geometria non viene usata: chiediamo solo distanza e durata
+    data = client.get_json(
+        f"/route/v1/driving/{_format_coords([start_coords, end_coords])}",
+        params={"overview": "false"},
+    )
+    if data.get("code") != "Ok":
+        raise ValueError(f"Risposta OSRM non valida: {data.get('code')} {data.get('message', '')}")
+
+    route = data["routes"][0]
+    return route["distance"] / 1000, route["duration"] / 60
+
+
+def fetch_route_geometry(start_coords, end_coords, client=None):
+    """
+    Geometria completa [(lat, lon), ...] del percorso tra due punti, con
+    l'endpoint /route di OSRM (come polyline, molto più compatta del GeoJSON).
+    """
+    client = client or get_client("osrm")
+    data = client.get_json(
+        f"/route/v1/driving/{_format_coords([start_coords, end_coords])}",
+        params={"overview": "full", "geometries": "polyline"},
+    )
+    if data.get("code") != "Ok":
+        raise ValueError(f"Risposta OSRM non valida: {data.get('code')} {data.get('message', '')}")
+    return decode_polyline(data["routes"][0]["geometry"])
+
+
+def _fetch_table_block(client, coords_list, sources, destinations):
+    # Richiede un blocco sources x destinations della matrice
+    block_ids = list(dict.fromkeys(sources + destinations))
+    position = {idx: pos for pos, idx in enumerate(block_ids)}
+    params = {
+        "annotations": "distance,duration",
+        "sources": ";".join(str(position[i]) for i in sources),
+        "destinations": ";".join(str(position[j]) for j in destinations),
+    }
+
+    data = client.get_json(
+        f"/table/v1/driving/{_format_coords([coords_list[i] for i in block_ids])}",
+        params=params,
+    )
+    if data.get("code") != "Ok":
+        raise ValueError(f"Risposta OSRM non valida: {data.get('code')} {data.get('message', '')}")
+
+    # I valori null (punti non raggiungibili) diventano NaN
+    distances = np.array(data["distances"], dtype=float)
+    durations = np.array(data["durations"], dtype=float)
+    return distances, durations
+
+
+def _split(indices, size):
+    return [indices[start:start + size] for start in range(0, len(indices), size)]
+
+
+def fetch_table(coords_list, sources=None, destinations=None, client=None,
+                max_coords=DEFAULT_TABLE_MAX_COORDS):
+    """
+    Calcola la matrice di distanze (km) e durate (minuti) con l'endpoint
+    /table di OSRM.
+
+    Di default viene calcolata la matrice completa; con sources e
+    destinations si richiede solo il sottoinsieme di righe e colonne
+    indicato. Se i punti superano max_coords la richiesta viene suddivisa
+    in blocchi sources x destinations, richiesti in parallelo.
+    Le celle non calcolate restano NaN.
+    """
+    client = client or get_client("osrm")
+    n = len(coords_list)
+    distances = np.full((n, n), np.nan)
+    durations = np.full((n, n), np.nan)
+    np.fill_diagonal(distances, 0)
+    np.fill_diagonal(durations, 0)
+
+    sources = list(range(n)) if sources is None else sorted(set(sources))
+    destinations = list(range(n)) if destinations is None else sorted(set(destinations))
+    if not sources or not destinations:
+        return distances, durations
+
+    if len(set(sources) | set(destinations)) <= max_coords:
+        blocks = [(sources, destinations)]
+    else:
+        chunk = max(1, max_coords // 2)
+        blocks = [
+            (block_sources, block_destinations)
+            for block_sources in _split(sources, chunk)
+            for block_destinations in _split(destinations, chunk)
+        ]
+
+    results = client.map(
+        lambda block: _fetch_table_block(client, coords_list, block[0], block[1]),
+        blocks,
+    )
+    for (block_sources, block_destinations), result in zip(blocks, results):
+        if isinstance(result, Exception):
+            logger.warning(
+                "Richiesta /table fallita per un blocco %dx%d: %s",
+                len(block_sources), len(block_destinations), result,
+            )
+            continue
+        block_dist, block_dur = result
+        distances[np.ix_(block_sources, block_destinations)] = block_dist / 1000  # Converti in km
+        durations[np.ix_(block_sources, block_destinations)] = block_dur / 60  # Converti in minuti
+
+    np.fill_diagonal(distances, 0)
+    np.fill_diagonal(durations, 0)
+    return distances, durations
+
+
+def fetch_routes(pairs, client=None):
+    """
+    Calcola in parallelo una lista di tratte [(origine, destinazione), ...]
+    con /route. Per ogni tratta restituisce (distanza, durata) oppure
+    l'eccezione sollevata.
+    """
+    client = client or get_client("osrm")
+    return client.map(lambda pair: fetch_route(pair[0], pair[1], client), pairs)
+
+
+def fetch_route_geometries(pairs, client=None):
+    """
+    Geometrie di una lista di tratte [(origine, destinazione), ...], in
+    parallelo. Per ogni tratta restituisce la geometria oppure l'eccezione.
+    """
+    client = client or get_client("osrm")
+    return client.map(lambda pair: fetch_route_geometry(pair[0], pair[1], client), pairs)
+
+
+def fetch_table_rows(coords_list, destinations_by_source, client=None):
+    """
+    Calcola solo le tratte richieste, con una richiesta /table per ogni
+    origine verso le sue destinazioni {origine: [destinazioni]}, in parallelo.
+
+    Restituisce {(origine, destinazione): (distanza, durata)} con le sole
+    tratte calcolate.
+    """
+    client = client or get_client("osrm")
+    rows = [(i, sorted(set(js))) for i, js in destinations_by_source.items() if js]
+    results = client.map(lambda row: _fetch_table_block(client, coords_list, [row[0]], row[1]), rows)
+
+    legs = {}
+    for (i, destinations), result in zip(rows, results):
+        if isinstance(result, Exception):
+            logger.warning("Richiesta /table fallita per l'origine %d: %s", i, result)
+            continue
+        block_dist, block_dur = result
+        for j, dist, dur in zip(destinations, block_dist[0], block_dur[0]):
+            if not (np.isnan(dist) or np.isnan(dur)):
+                legs[i, j] = (dist / 1000, dur / 60)  # Converti in km e minuti
+    return legs
+
+
+def fetch_table_blocks(coords_list, blocks, client=None, max_coords=DEFAULT_TABLE_MAX_COORDS):
+    """
+    Calcola in parallelo più blocchi quadrati della matrice [[punti], ...]:
+    per ogni blocco tutte le tratte tra i suoi punti, con una richiesta
+    /table (suddivisa se il blocco supera max_coords punti).
+
+    Restituisce {(origine, destinazione): (distanza, durata)} con le sole
+    tratte calcolate.
+    """
+    client = client or get_client("osrm")
+    chunk = max(1, max_coords // 2)
+    queries = []
+    for points in blocks:
+        points = sorted(set(points))
+        if len(points) <= max_coords:
+            queries.append((points, points))
+        else:
+            queries.extend(
+                (block_sources, block_destinations)
+                for block_sources in _split(points, chunk)
+                for block_destinations in _split(points, chunk)
+            )
+
+    results = client.map(
+        lambda block: _fetch_table_block(client, coords_list, block[0], block[1]),
+        queries,
+    )
+    legs = {}
+    for (sources, destinations), result in zip(queries, results):
+        if isinstance(result, Exception):
+            logger.warning("Richiesta /table fallita per un blocco %dx%d: %s", len(sources), len(destinations), result)
+            continue
+        block_dist, block_dur = result
+        for a, i in enumerate(sources):
+            for b, j in enumerate(destinations):
+                if i != j and not (np.isnan(block_dist[a, b]) or np.isnan(block_dur[a, b])):
+                    legs[i, j] = (block_dist[a, b] / 1000, block_dur[a, b] / 60)  # Converti in km e minuti
+    return legs
+
+
+class RoutingBackend:
+    """
+    Interfaccia dei motori di calcolo delle tratte.
+
+    Distanze in km, durate in minuti. Le celle o le tratte non calcolabili
+    restano NaN (table) o non compaiono nel risultato (table_rows e
+    table_blocks); route e route_geometry sollevano un'eccezione.
+    """
+
+    # Nome usato per separare le cache delle tratte dei diversi motori
+    name = None
+
+    def table(self, coords_list, sources=None, destinations=None):
+        raise NotImplementedError
+
+    def table_rows(self, coords_list, destinations_by_source):
+        raise NotImplementedError
+
+    def table_blocks(self, coords_list, blocks):
+        # Tutte le tratte tra i punti di ogni blocco [[punti], ...]
+        legs = {}
+        for points in blocks:
+            legs.update(self.table_rows(coords_list, {i: [j for j in points if j != i] for i in points}))
+        return legs
+
+    def route(self, start_coords, end_coords):
+        raise NotImplementedError
+
+    def routes(self, pairs):
+        return self._each(self.route, pairs)
+
+    def route_geometry(self, start_coords, end_coords):
+        raise NotImplementedError
+
+    def route_geometries(self, pairs):
+        return self._each(self.route_geometry, pairs)
+
+    @staticmethod
+    def _each(fn, pairs):
+        results = []
+        for start_coords, end_coords in pairs:
+            try:
+                results.append(fn(start_coords, end_coords))
+            except Exception as e:
+                results.append(e)
+        return results
+
+
+class OSRMBackend(RoutingBackend):
+    """Motore OSRM interrogato via HTTP (server pubblico o nostro server)."""
+
+    name = "osrm"
+
+    def __init__(self, client=None):
+        self.client = client
+
+    def table(self, coords_list, sources=None, destinations=None):
+        return fetch_table(coords_list, sources, destinations, client=self.client)
+
+    def table_rows(self, coords_list, destinations_by_source):
+        return fetch_table_rows(coords_list, destinations_by_source, client=self.client)
+
+    def table_blocks(self, coords_list, blocks):
+        return fetch_table_blocks(coords_list, blocks, client=self.client)
+
+    def route(self, start_coords, end_coords):
+        return fetch_route(start_coords, end_coords, client=self.client)
+
+    def routes(self, pairs):
+        return fetch_routes(pairs, client=self.client)
+
+    def route_geometry(self, start_coords, end_coords):
+        return fetch_route_geometry(start_coords, end_coords, client=self.client)
+
+    def route_geometries(self, pairs):
+        return fetch_route_geometries(pairs, client=self.client)
+
+
+# Funzione per creare il motore configurato: OSRM via HTTP di default, oppure
+# il grafo stradale locale indicato da TRAGITTO_ROUTING_GRAPH (.npz, .osm o .pbf)
+def get_backend():
+    graph_path = os.environ.get("TRAGITTO_ROUTING_GRAPH")
+    if graph_path:
+        from offline_routing import LocalGraphBackend
+        return LocalGraphBackend(graph_path)
+    return OSRMBackend()
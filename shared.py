@@ -0,0 +1,136 @@
+"""
+Strutture condivise tra tutti i thread del processo (e quindi tra tutte le
+sessioni Streamlit servite dallo stesso server).
+
+MemoryCache è una cache LRU in memoria, usata davanti alle cache su SQLite
+per non rileggere dal disco le voci più usate; tiene nota degli accessi così
+che la cache su disco possa aggiornarne l'ultimo uso a blocchi. SingleFlight unisce le
+richieste identiche in corso: se due sessioni chiedono nello stesso momento
+lo stesso indirizzo o la stessa tratta, la richiesta al servizio esterno
+parte una volta sola e l'altra sessione ne attende il risultato.
+"""
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class MemoryCache:
+    """
+    Cache LRU thread-safe con scadenza per voce, al massimo max_entries voci.
+
+    Ogni get() riuscito registra l'ora dell'accesso; take_accesses() restituisce
+    e azzera gli accessi registrati.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._accesses = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Restituisce (trovato, valore)."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            value, expires_at = entry
+            if expires_at < now:
+                del self._entries[key]
+                return False, None
+            self._entries.move_to_end(key)
+            self._accesses[key] = now
+            return True, value
+
+    def put(self, key, value, expires_at):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def take_accesses(self, min_count=1):
+        """
+        Restituisce {chiave: ora dell'ultimo accesso} degli accessi registrati
+        e li azzera, oppure {} se sono meno di min_count.
+        """
+        with self._lock:
+            if len(self._accesses) < min_count:
+                return {}
+            accesses, self._accesses = self._accesses, {}
+            return accesses
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._accesses.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SingleFlight:
+    """
+    Unione delle richieste identiche in corso, indicizzate su una chiave.
+
+    claim() assegna al chiamante le chiavi che nessuno sta già richiedendo e
+    restituisce un Future per le altre; chi ha ottenuto delle chiavi deve
+    sempre chiamare finish() (anche in caso di errore) per sbloccare chi
+    attende.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def claim(self, keys):
+        """Restituisce (chiavi assegnate al chiamante, {chiave già in corso: Future})."""
+        owned, waiting = [], {}
+        with self._lock:
+            for key in dict.fromkeys(keys):
+                future = self._calls.get(key)
+                if future is None:
+                    self._calls[key] = Future()
+                    owned.append(key)
+                else:
+                    waiting[key] = future
+        return owned, waiting
+
+    def finish(self, keys, results):
+        """
+        Pubblica i risultati {chiave: valore oppure eccezione} delle chiavi
+        assegnate; le chiavi senza risultato vengono segnalate come fallite.
+        """
+        with self._lock:
+            futures = [(key, self._calls.pop(key)) for key in keys if key in self._calls]
+        for key, future in futures:
+            result = results.get(key, _MISSING)
+            if result is _MISSING:
+                future.set_exception(RuntimeError(f"Richiesta non completata: {key!r}"))
+            elif isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
+
+
+_MISSING = object()
+
+_flights = {}
+_flights_lock = threading.Lock()
+
+
+# Funzione per ottenere l'unione delle richieste condivisa di un tipo di richiesta (es. "geocode")
+def get_flight(name):
+    with _flights_lock:
+        flight = _flights.get(name)
+        if flight is None:
+            flight = _flights[name] = SingleFlight()
+        return flight
@@ -0,0 +1,155 @@
+import time
+
+import numpy as np
+
+# Fino a questo numero di tappe (casa esclusa) il percorso viene calcolato
+# in modo esatto con Held-Karp; oltre si usa la ricerca locale
+HELD_KARP_MAX_STOPS = 15
+
+# Tempo massimo (in secondi) per la ricerca locale 2-opt/Or-opt
+DEFAULT_TIME_BUDGET = 0.05
+
+
+# Funzione per calcolare il costo di un percorso (lista di indici)
+def tour_cost(matrix, path):
+    path = np.asarray(path)
+    return float(matrix[path[:-1], path[1:]].sum())
+
+
+# Funzione per costruire un percorso iniziale con l'euristica del vicino più prossimo
+def nearest_neighbour_tour(matrix):
+    n = matrix.shape[0]
+    path = [0]
+    remaining = set(range(1, n))
+    while remaining:
+        current = path[-1]
+        next_stop = min(remaining, key=lambda x: matrix[current, x])
+        path.append(next_stop)
+        remaining.remove(next_stop)
+    path.append(0)
+    return path
+
+
+def held_karp(matrix):
+    """
+    Percorso ottimo esatto casa → tappe → casa con la programmazione
+    dinamica di Held-Karp.
+
+    dp[mask, j] è il costo minimo per partire da casa, visitare l'insieme
+    di tappe mask e terminare in j. Gli insiemi con lo stesso numero di
+    tappe vengono elaborati insieme con operazioni vettoriali NumPy.
+    """
+    n = matrix.shape[0]
+    m = n - 1
+    if m <= 1:
+        return list(range(n)) + [0]
+
+    cost = np.asarray(matrix, dtype=float)
+    stops = cost[1:, 1:]
+    full = (1 << m) - 1
+
+    dp = np.full((1 << m, m), np.inf)
+    parent = np.full((1 << m, m), -1, dtype=np.int8)
+    for j in range(m):
+        dp[1 << j, j] = cost[0, j + 1]
+
+    masks = np.arange(1 << m)
+    popcount = np.zeros(1 << m, dtype=np.int8)
+    for j in range(m):
+        popcount += (masks >> j) & 1
+
+    for size in range(2, m + 1):
+        layer = masks[popcount == size]
+        for j in range(m):
+            bit = 1 << j
+            with_j = layer[(layer & bit) != 0]
+            previous = with_j ^ bit
+            # candidates[x, k] = costo per arrivare in k e poi andare in j
+            candidates = dp[previous] + stops[:, j]
+            best = np.argmin(candidates, axis=1)
+            dp[with_j, j] = candidates[np.arange(len(with_j)), best]
+            parent[with_j, j] = best
+
+    last = int(np.argmin(dp[full] + cost[1:, 0]))
+
+    # Ricostruisce il percorso a ritroso
+    path = []
+    mask = full
+    while last >= 0:
+        path.append(last + 1)
+        previous = int(parent[mask, last])
+        mask ^= 1 << last
+        last = previous
+    return [0] + path[::-1] + [0]
+
+
+def _two_opt_pass(matrix, path):
+    # Inverte un segmento path[i+1..j] se riduce il costo (la matrice può essere asimmetrica)
+    n = len(path)
+    nodes = np.asarray(path)
+    forward = np.concatenate(([0.0], np.cumsum(matrix[nodes[:-1], nodes[1:]])))
+    backward = np.concatenate(([0.0], np.cumsum(matrix[nodes[1:], nodes[:-1]])))
+    for i in range(0, n - 3):
+        a, b = path[i], path[i + 1]
+        for j in range(i + 2, n - 1):
+            c, d = path[j], path[j + 1]
+            delta = (
+                matrix[a, c] + matrix[b, d] - matrix[a, b] - matrix[c, d]
+                + (backward[j] - backward[i + 1]) - (forward[j] - forward[i + 1])
+            )
+            if delta < -1e-9:
+                return path[:i + 1] + path[i + 1:j + 1][::-1] + path[j + 1:]
+    return None
+
+
+def _or_opt_pass(matrix, path):
+    # Sposta un segmento di 1-3 tappe consecutive in un'altra posizione
+    n = len(path)
+    for length in (1, 2, 3):
+        for i in range(1, n - length):
+            segment = path[i:i + length]
+            prev, nxt = path[i - 1], path[i + length]
+            removal_gain = matrix[prev, segment[0]] + matrix[segment[-1], nxt] - matrix[prev, nxt]
+            rest = path[:i] + path[i + length:]
+            for k in range(len(rest) - 1):
+                if k == i - 1:
+                    continue
+                a, b = rest[k], rest[k + 1]
+                insertion_cost = matrix[a, segment[0]] + matrix[segment[-1], b] - matrix[a, b]
+                if insertion_cost - removal_gain < -1e-9:
+                    return rest[:k + 1] + segment + rest[k + 1:]
+    return None
+
+
+def local_search(matrix, path, time_budget=DEFAULT_TIME_BUDGET):
+    """
+    Migliora un percorso con mosse 2-opt e Or-opt finché non trova più
+    miglioramenti o finché non scade il tempo a disposizione.
+    """
+    deadline = time.perf_counter() + time_budget
+    while time.perf_counter() < deadline:
+        improved = _two_opt_pass(matrix, path)
+        if improved is None:
+            improved = _or_opt_pass(matrix, path)
+        if improved is None:
+            break
+        path = improved
+    return path
+
+
+def solve_tour(matrix, exact_max_stops=HELD_KARP_MAX_STOPS, time_budget=DEFAULT_TIME_BUDGET):
+    """
+    Trova il percorso di costo minimo che parte da casa (indice 0), visita
+    tutte le tappe e torna a casa.
+
+    Con al più exact_max_stops tappe il risultato è ottimo (Held-Karp),
+    altrimenti è il miglior percorso trovato dalla ricerca locale partendo
+    dal vicino più prossimo. Il percorso restituito inizia e termina con 0.
+    """
+    matrix = np.asarray(matrix, dtype=float)
+    n = matrix.shape[0]
+    if n <= 1:
+        return [0]
+    if n - 1 <= exact_max_stops:
+        return held_karp(matrix)
+    return local_search(matrix, nearest_neighbour_tour(matrix), time_budget)